@@ -104,7 +104,7 @@ def findInitialCapitalCandidates(baseFacs):
     """
     initialCapCandidateList = []
 
-    leftMostCC = dia.findBorderMostConnectedComponents(baseFacs.getImage(), 'left', 200, "initialCap")
+    leftMostCC = dia.findBorderMostConnectedComponents(baseFacs.getImage(), 'left', 200, "initialCap", baseFacs.getLabelling())
 
     # Calculate median bounding box
     medianTemp = []
@@ -158,23 +158,26 @@ def findVerticalSpaceCandidates(facsIn, forceMinHeight = False):
 
     cleanArea = facsIn.getImage()
     # Let's find substantial CCs
-    ccList = dia.findConnectedComponents(cleanArea, 150)  # note: clears the area
+    labelling = facsIn.getLabelling()
 
     heightTemp = []
+    substantials = []
 
-    for l in range(0, len(ccList)):
-        (imin,imax,jmin,jmax) = ccList[l].getMinMax()
+    for label in range(1, labelling.getCount()+1):
+        if labelling.getPixelCount(label) <= 150:
+            continue
+        (imin,imax,jmin,jmax) = labelling.getMinMax(label)
         # require a min width to be included in the substantials
         if jmax-jmin < 10:
             continue
 
         heightTemp.append(imax-imin)
+        substantials.append(label)
 
-        pl = ccList[l].getPixelList()
-        # redraws the found substantial CCs
-        for p in range(0, len(pl)):
-            i,j = pl[p]
-            cleanArea[i][j] = 0
+    # Only the substantial CCs are left in the area.
+    labels = labelling.getLabels()
+    cleanArea[labels != 0] = 255
+    cleanArea[np.isin(labels, substantials)] = 0
 
     heightTemp.sort()
     medianHeight = heightTemp[ int(len(heightTemp)/2) ]
@@ -183,14 +186,11 @@ def findVerticalSpaceCandidates(facsIn, forceMinHeight = False):
         medianHeight = forceMinHeight
 
     # As vertical spaces, we save a sequence of white runs across the column image.
+    emptyRows = (cleanArea == 255).all(axis=1)
     spaceStart = 0
     spaceEnd = 0
     for i in range(0, cleanArea.shape[0]):
-        isEmpty = True
-        for j in range(0, cleanArea.shape[1]):
-            if cleanArea[i][j] != 255:
-                isEmpty = False
-                break
+        isEmpty = emptyRows[i]
 
         if (isEmpty):
             # empty line of pixels found, let's continue looking
@@ -242,12 +242,11 @@ def segmentColumn(colFacs, initialCandidateList, spaceCandidateList, pageI, colJ
 
     # Let's prepare a column array without initial capitals' pixels.
     for i in range(0, len(initialCandidateList)):
-        pixelList = initialCandidateList[i].getPixelList()
-        for r in range(0, len(pixelList)):
-            i,j = pixelList[r]
-            colArrayWithoutInitials[i][j] = 255
+        ii, jj = initialCandidateList[i].getInitialCC().getPixels()
+        colArrayWithoutInitials[ii, jj] = 255
 
-    columnLines = findLines(colArrayWithoutInitials)
+    # (The initials are whole CCs of the column image, so its labelling still holds for the array without them.)
+    columnLines = findLines(colArrayWithoutInitials, colFacs.getLabelling())
 
     # FIRST PASS: Find physical sections and valid spaces/initials according to spaces.
     thisArea = None
@@ -409,31 +408,29 @@ def getLinesForArea(start, end, lines):
 
 def getImageArea(baseArea, iTop, jTop, iBottom, jBottom):
     """
-    Returns the image area according to the given coordinates.
+    Returns the image area according to the given coordinates (a view of baseArea when within it; see
+    dia.cropArea()).
     """
 
-    # Get the image to work with; PIL is used to create the image and to perform the crop.
-    tempImage = Image.fromarray(baseArea)
-
-    # Crop the image according to the region we specified by searching for the cutoff points.
-    box = (jTop, iTop, jBottom, iBottom)
-    croppedRegion = tempImage.crop(box)
-
-    return np.array(croppedRegion)
+    return dia.cropArea(baseArea, iTop, iBottom, jTop, jBottom)
 
 
-def findLines(arrayIn):
+def findLines(arrayIn, labelling=None):
     """
     Searches for and returns graphical lines from the given column image.
     Note: this function should be re-designed completely (and made yet more robust).
+    :param labelling: optionally, a ComponentLabelling of arrayIn (or of an image arrayIn was derived from by clearing
+        whole components) to reuse
     """
     arrayClean = arrayIn.copy()
     tempArray = dia.getRGBArray(arrayIn)
+    if labelling is None:
+        labelling = dia.ComponentLabelling(arrayIn)
 
     # Finds the lines according to left and right-most CCs.
     # Note: Only CCs with immediate neighbours should be accepted.
-    leftMostCC = dia.findBorderMostConnectedComponents(arrayClean, 'left', 50, "lineFinding")
-    rightMostCC = dia.findBorderMostConnectedComponents(arrayClean, 'right', 50, "lineFinding")
+    leftMostCC = dia.findBorderMostConnectedComponents(arrayClean, 'left', 50, "lineFinding", labelling)
+    rightMostCC = dia.findBorderMostConnectedComponents(arrayClean, 'right', 50, "lineFinding", labelling)
 
     # Create a temporary combo list
     ccListCombo = []
@@ -458,59 +455,48 @@ def findLines(arrayIn):
         # if over twice the size:
         if ((imax-imin) > (medianHeight*2.5)):   # 2 to 2.5 9th Dec
             # split the CC in the middle (it's a common occurrence that CC's from adjacent lines are entangled)
-            pixList = ccListCombo[i].getPixelList()
-            pixListTop = []
-            pixListBottom = []
-
-            for j in range(0, len(pixList)):
-                if pixList[j][0] < (imin+((imax-imin)/2)):
-                    pixListTop.append(pixList[j])
-                else:
-                    pixListBottom.append(pixList[j])
+            ii, jj = ccListCombo[i].getPixels()
+            top = ii < (imin+((imax-imin)/2))
+            newTop = dia.ConnectedComponent(None, ii[top], jj[top])
+            newBottom = dia.ConnectedComponent(None, ii[~top], jj[~top])
 
             # remove the old one; add the two new ones.
             if ccListCombo[i] in leftMostCC:
                 leftMostCC.remove( ccListCombo[i] )
-                newTop = dia.ConnectedComponent(pixListTop)
-                newBottom = dia.ConnectedComponent(pixListBottom)
                 leftMostCC.append(newTop)
                 leftMostCC.append(newBottom)
 
             else:
                 rightMostCC.remove( ccListCombo[i] )
-                rightMostCC.append(dia.ConnectedComponent(pixListTop))
-                rightMostCC.append(dia.ConnectedComponent(pixListBottom))
+                rightMostCC.append(newTop)
+                rightMostCC.append(newBottom)
 
     # Complement borderMosts with the next close-by inward CCs to find a more robust seed for the line recognition.
     complementArea = arrayIn.copy()
     for i in range(0, len(leftMostCC)):
-        for j in range(0, len(leftMostCC[i].getPixelList())):
-            complementArea[leftMostCC[i].getPixelList()[j][0]][leftMostCC[i].getPixelList()[j][1]] = 255
+        ii, jj = leftMostCC[i].getPixels()
+        complementArea[ii, jj] = 255
     for i in range(0, len(rightMostCC)):
-        for j in range(0, len(rightMostCC[i].getPixelList())):
-            complementArea[rightMostCC[i].getPixelList()[j][0]][rightMostCC[i].getPixelList()[j][1]] = 255
+        ii, jj = rightMostCC[i].getPixels()
+        complementArea[ii, jj] = 255
 
-    complementCCList = dia.findConnectedComponents(complementArea, 40)
+    complementCCList = dia.findConnectedComponents(complementArea, 40, labelling=labelling)
 
     leftMostCC = complementBorderMosts(leftMostCC, complementCCList)
     rightMostCC = complementBorderMosts(rightMostCC, complementCCList)
 
     arrayRest = arrayIn.copy()
     for i in range(0, len(leftMostCC)):
-        for j in range(0, len(leftMostCC[i].getPixelList())):
-            arrayRest[leftMostCC[i].getPixelList()[j][0]][leftMostCC[i].getPixelList()[j][1]] = 255
+        ii, jj = leftMostCC[i].getPixels()
+        arrayRest[ii, jj] = 255
         imin,imax,jmin,jmax = leftMostCC[i].getMinMax()
-        for k in range(imin,imax):
-            for l in range(0, jmin):
-                arrayRest[k][l] = 255
+        arrayRest[imin:imax, 0:jmin] = 255
 
     for i in range(0, len(rightMostCC)):
-        for j in range(0, len(rightMostCC[i].getPixelList())):
-            arrayRest[rightMostCC[i].getPixelList()[j][0]][rightMostCC[i].getPixelList()[j][1]] = 255
+        ii, jj = rightMostCC[i].getPixels()
+        arrayRest[ii, jj] = 255
         imin,imax,jmin,jmax = rightMostCC[i].getMinMax()
-        for k in range(imin,imax):
-            for l in range(jmax, arrayRest.shape[1]-1):
-                arrayRest[k][l] = 255
+        arrayRest[imin:imax, jmax:arrayRest.shape[1]-1] = 255
 
     pairs = findPairs(arrayIn, leftMostCC, rightMostCC)
     lines = completeLines(arrayRest, pairs)
@@ -527,17 +513,19 @@ def complementBorderMosts(borderMostCC, complementCCList):
     Complements CCs that have been located in the border-most position (i.e. at either edge).
     """
     # Complement identified border mosts with close-by and horizontally level CCs
-    # TODO: this is amazingly inefficient in terms of computing time; it compares them all.
     removalList = []
     appendList = []
 
+    # Only the CCs overlapping the rows of a border most CC, and close enough by their bounding boxes, are examined.
+    complementIndex = dia.ComponentIndex(complementCCList)
+
     for i in range(0, len(borderMostCC)):
+        imin,imax,jmin,jmax = borderMostCC[i].getMinMax()
         found = False
 
-        for j in range(0, len(complementCCList)):
+        for j in complementIndex.queryDistance(borderMostCC[i], 15):
 
-            imin,imax,jmin,jmax = borderMostCC[i].getMinMax()
-            imin2,imax2,jmin2,jmax2 = complementCCList[j].getMinMax()
+            imin2,imax2,jmin2,jmax2 = complementIndex.getMinMax(j)
 
             # horizontally level
             if (imin > imax2 or imax < imin2):
@@ -557,16 +545,14 @@ def complementBorderMosts(borderMostCC, complementCCList):
             if (overlapEnd-overlapStart) < 5:
                 continue
 
-            dist = dia.calculateCCDistance2(borderMostCC[i], complementCCList[j])
+            dist = dia.calculateCCDistance2(borderMostCC[i], complementCCList[j], 15)
             if (dist < 15):
                 # append pixels to leftMostCC
-                pixList1 = borderMostCC[i].getPixelList()
-                pixList2 = complementCCList[j].getPixelList()
-                for k in range(0, len(pixList2)):
-                    pixList1.append(pixList2[k])
+                ii1, jj1 = borderMostCC[i].getPixels()
+                ii2, jj2 = complementCCList[j].getPixels()
 
                 removalList.append( borderMostCC[i])
-                appendList.append(dia.ConnectedComponent(pixList1))
+                appendList.append(dia.ConnectedComponent(None, np.concatenate((ii1, ii2)), np.concatenate((jj1, jj2))))
                 found = True
                 break
         if (found):
@@ -668,9 +654,12 @@ def completeLines(arrayRest, pairs):
     lines = []
     heightList = []
 
+    # Only whole CCs are cleared from arrayRest below, so one labelling serves all the pairs.
+    labelling = dia.ComponentLabelling(arrayRest)
+
     for i in range(0, len(pairs)):
         lineCCList = []
-        ccListRest = dia.findConnectedComponents(arrayRest, 50, -1, pairs[i][2], pairs[i][3], 0, arrayRest.shape[1])
+        ccListRest = dia.findConnectedComponents(arrayRest, 50, -1, pairs[i][2], pairs[i][3], 0, arrayRest.shape[1], labelling)
         # sanity check: remove CCs that are too high (e.g. joint characters between two lines)
 
         for j in range(0, len(ccListRest)):
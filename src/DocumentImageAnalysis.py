@@ -8,7 +8,10 @@
 
 from PIL import Image
 import numpy
+from scipy import ndimage
+from scipy.spatial import cKDTree
 import os
+from concurrent.futures import ThreadPoolExecutor
 import Levers
 import DocumentImageUnderstanding as diu
 import HelperFunctions as fu
@@ -16,10 +19,23 @@ import ColumnLevel as col
 import math
 
 
+# Border removal (see cropBorderShadows()): the width of the bands blackened next to the image borders, and the
+# margin cropped in from the border peaks (px). Also part of the spread stage cache keys (see SpreadLevel).
+borderBandWidth = 50
+borderCropMargin = 50
+
+
 class Facsimile():
     """
     Holds the loaded or generated document images; keeps track of their type, a cascading coordinate offset
-    to the original facsimile, and optionally a reference to the parent image.
+    to the original facsimile, and optionally a reference to the parent image. A rotated facsimile also records the
+    affine transform that maps its coordinates back to the image it was rotated from (see rotateImages()).
+
+    A facsimile also caches results computed from its image: the component labelling, so that the stages working on
+    the same image (e.g. initial capital and vertical space candidates, line finding) label it only once; and a
+    summed-area table of the ink (black pixels), from which the projections and the ink count of any rectangle are
+    read with a few lookups. The cache is keyed by the image version, which setImage() (or touch(), after modifying
+    the image in place) increments.
     """
 
     def __init__(self, inputImage, imageType, offset=None, parent=None):
@@ -27,12 +43,94 @@ class Facsimile():
         self.imageType = imageType
         self.offset = offset
         self.parent = parent
+        self.transform = None
+        self.version = 0
+        self.cache = {}
 
     def getImage(self):
+        """
+        Returns a writable copy of the image; use getView() when the image is only read.
+        """
         return self.image.copy()
 
+    def getView(self):
+        """
+        Returns a read-only view of the image (no copy).
+        Note: the view follows the image array; setImage() replaces the array rather than modifying it.
+        """
+        view = self.image.view()
+        view.flags.writeable = False
+        return view
+
+    def getShape(self):
+        return self.image.shape
+
+    def getRegion(self, imin, imax, jmin, jmax, imageType, offset=None):
+        """
+        Returns a child facsimile of the region [imin, imax) x [jmin, jmax) of the image. Its image is a read-only
+        view sharing memory with this facsimile's (see cropArea()); getImage() gives a writable copy as usual.
+        :param offset: the child's offset; by default, this facsimile's offset moved by (imin, jmin)
+        :return: Facsimile
+        """
+        if offset is None:
+            (i, j) = self.offset if self.offset is not None else (0, 0)
+            offset = (i + imin, j + jmin)
+        return Facsimile(cropArea(self.getView(), imin, imax, jmin, jmax), imageType, offset, self)
+
     def setImage(self, imageArea):
         self.image = imageArea
+        self.touch()
+
+    def touch(self):
+        """
+        Marks the image as modified; drops the cached results.
+        """
+        self.version += 1
+        self.cache = {}
+
+    def getLabelling(self):
+        """
+        Returns the (cached) ComponentLabelling of the current image.
+        """
+        key = (self.version, 'labelling')
+        if key not in self.cache:
+            self.cache[key] = ComponentLabelling(self.image)
+        return self.cache[key]
+
+    def getSummedAreaTable(self):
+        """
+        Returns the (cached) summed-area table of the ink: an array of shape (height+1, width+1), where [i, j] holds
+        the number of black pixels above and left of pixel (i, j).
+        """
+        key = (self.version, 'summedAreaTable')
+        if key not in self.cache:
+            (h, w) = self.image.shape[0:2]
+            table = numpy.zeros((h+1, w+1), dtype=numpy.int32)
+            numpy.cumsum(numpy.cumsum(self.image == 0, axis=0, dtype=numpy.int32), axis=1, out=table[1:, 1:])
+            self.cache[key] = table
+        return self.cache[key]
+
+    def getInkCount(self, imin, imax, jmin, jmax):
+        """
+        Returns the number of black pixels in the rectangle [imin, imax) x [jmin, jmax).
+        """
+        table = self.getSummedAreaTable()
+        return int(table[imax, jmax]) - int(table[imin, jmax]) - int(table[imax, jmin]) + int(table[imin, jmin])
+
+    def getProjectionCounts(self, region=None):
+        """
+        Returns the black pixel counts of the rows (horizontal projection) and of the columns (vertical projection)
+        of the image, or of its region (imin, imax, jmin, jmax) (half-open), as lists.
+        """
+        table = self.getSummedAreaTable()
+        if region is None:
+            (imin, imax, jmin, jmax) = (0, table.shape[0]-1, 0, table.shape[1]-1)
+        else:
+            (imin, imax, jmin, jmax) = region
+
+        rowSums = table[imin:imax+1, jmax] - table[imin:imax+1, jmin]
+        colSums = table[imax, jmin:jmax+1] - table[imin, jmin:jmax+1]
+        return numpy.diff(rowSums).tolist(), numpy.diff(colSums).tolist()
 
     def setOffset(self, offsetLeft, offsetTop):
         self.offset = (offsetLeft, offsetTop)
@@ -46,9 +144,20 @@ class Facsimile():
     def getParent(self):
         return self.parent
 
-    def save(self, fileName="default", directory="default", fileType = "default"):
-        imageToSave = Image.fromarray(self.image)
+    def setTransform(self, transform):
+        self.transform = transform
+
+    def getTransform(self):
+        return self.transform
 
+    def save(self, fileName="default", directory="default", fileType = "default", synchronous=False):
+        """
+        Saves the image into the results directory; with Levers.writeImagesInBackground, the image is written by the
+        shared background writer (see fu.ImageWriter; fu.flushImages() waits for the writes).
+        Numbered debug images (default fileName) go to the spread's debug bundle instead, if one is open (see
+        fu.openDebugBundle()).
+        :param synchronous: if True, the file is written before returning (e.g. when it is read right after)
+        """
         if directory == "default":
             dire = str(Levers.saveDir)
         else:
@@ -70,83 +179,169 @@ class Facsimile():
             fswitch = "PNG"
             print ("Not implemented yet.")
 
+        bundle = fu.getDebugBundle()
+        if bundle is not None and fileName == "default" and not synchronous:
+            offset = [int(x) for x in self.offset] if isinstance(self.offset, (tuple, list)) else None
+            entry = {'stage': self.imageType, 'index': Levers.imageIter, 'offset': offset}
+            if Levers.writeImagesInBackground:
+                fu.getImageWriter().write(self.image, fname, fswitch, bundle, entry)
+            else:
+                bundle.addImage(fname, self.image, fswitch, entry)
+            Levers.imageIter += 1
+            return
+
+        if Levers.writeImagesInBackground and not synchronous:
+            fu.getImageWriter().write(self.image, "results/" + dire + "/" + fname, fswitch)
+            Levers.imageIter += 1
+            return
+
         #Let's make sure saveDir exists
         if not os.path.exists(Levers.dir_out+dire):
             os.makedirs(Levers.dir_out+dire)
 
+        imageToSave = Image.fromarray(self.image)
         imageToSave.save("results/" + dire + "/" + fname, fswitch)
         Levers.imageIter += 1
 
 
+class RenderedFacsimile(Facsimile):
+    """
+    A visualisation facsimile kept as a description: a base image and drawing operations on its RGB copy. The image
+    is rasterised only when it is first needed (e.g. when saved, displayed or overlaid); when debugging is off and the
+    visualisation is not used, rendering costs nothing.
+    Note: the base image is held as a view; the drawing reflects the base array as it is when rasterised.
+    """
+
+    def __init__(self, baseFacs, operations, imageType, offset=None):
+        Facsimile.__init__(self, None, imageType, offset)
+
+        # Rendering on top of a rendering extends its description.
+        if isinstance(baseFacs, RenderedFacsimile) and baseFacs.rasterised is None:
+            self.baseArea = baseFacs.baseArea
+            self.operations = baseFacs.operations + list(operations)
+        else:
+            self.baseArea = baseFacs.getView()
+            self.operations = list(operations)
+
+    @property
+    def image(self):
+        if self.rasterised is None:
+            imgArray = getRGBArray(self.baseArea)
+            for (function, args) in self.operations:
+                imgArray = function(imgArray, *args)
+            self.rasterised = imgArray
+        return self.rasterised
+
+    @image.setter
+    def image(self, imageArea):
+        self.rasterised = imageArea
+
+    def getShape(self):
+        if self.rasterised is None:
+            return self.baseArea.shape[0:2] + (3,)
+        return self.rasterised.shape
+
+
+# 8-connectivity structuring element used for labelling connected components.
+EIGHT_CONNECTED = numpy.ones((3, 3), dtype=bool)
+
+
 class ConnectedComponent():
     """
-    Holds a list of pixels and associated functions to a Connected Component (8-connected), i.e. a grouping of
+    Holds the pixels and associated functions to a Connected Component (8-connected), i.e. a grouping of
     adjacent pixels (from a binarised image).
 
+    The pixels are stored compactly as two int32 coordinate arrays (i and j); the pixel count and the bounding box
+    are computed when the component is built. A CC can be built either from a list of (i, j) tuples or from the
+    two coordinate arrays.
+
     CCs are simple, but very useful in imposing low-level structure to image data and helping one to work with it.
        - For reference, see any book covering the basics of computer vision (e.g. Gonzalez and Woods. 2002. Digital Image Processing.)
     """
 
-    def __init__(self, pixList):
-        self.pixelList = pixList
-        self.borderPixels = []
+    __slots__ = ('pixelI', 'pixelJ', 'pixelList', 'borderPixels', 'borderTree', 'maxDist', 'iMin', 'iMax', 'jMin', 'jMax')
+
+    def __init__(self, pixList=None, pixelI=None, pixelJ=None):
+        if pixList is not None:
+            pixels = numpy.array(pixList, dtype=numpy.int32).reshape(-1, 2)
+            pixelI = pixels[:, 0]
+            pixelJ = pixels[:, 1]
+
+        self.pixelI = numpy.ascontiguousarray(pixelI, dtype=numpy.int32)
+        self.pixelJ = numpy.ascontiguousarray(pixelJ, dtype=numpy.int32)
+        self.pixelList = None  # A lazily built list of (i, j) tuples; see getPixelList().
+        self.borderPixels = None  # See getBorderPixels().
+        self.borderTree = None  # See getBorderTree().
         self.maxDist = 0
-        self.iMin = -1
-        self.iMax = -1
-        self.jMin = -1
-        self.jMax = -1
+        self.calculateMinMax()
 
     def getPixelCount(self):
-        return len(self.pixelList)
+        return len(self.pixelI)
+
+    def getPixels(self):
+        """
+        Returns the i and j coordinate arrays of the CC's pixels.
+        """
+        return self.pixelI, self.pixelJ
 
     def getPixelList(self):
+        """
+        Returns the CC's pixels as a list of (i, j) tuples. (A compatibility view; prefer getPixels().)
+        """
+        if self.pixelList is None:
+            self.pixelList = list(zip(self.pixelI.tolist(), self.pixelJ.tolist()))
         return self.pixelList
 
     def getBorderPixels(self):
-        if len(self.borderPixels) == 0:
+        """
+        Returns the CC's border pixels as an (n, 2) array of (i, j) coordinates; calculated once and cached.
+        """
+        if self.borderPixels is None:
             self.calculateBorderPixels()
         return self.borderPixels
 
+    def getBorderTree(self):
+        """
+        Returns a KD-tree over the CC's border pixels for nearest neighbour queries; built once and cached.
+        """
+        if self.borderTree is None:
+            self.borderTree = cKDTree(self.getBorderPixels())
+        return self.borderTree
+
+    def getMask(self, pad=0):
+        """
+        Returns a boolean mask of the CC's pixels over its bounding box, optionally padded with pad pixels per side.
+        The mask's (0, 0) corresponds to (iMin-pad, jMin-pad).
+        """
+        mask = numpy.zeros((self.iMax-self.iMin+1+2*pad, self.jMax-self.jMin+1+2*pad), dtype=bool)
+        mask[self.pixelI-self.iMin+pad, self.pixelJ-self.jMin+pad] = True
+        return mask
+
     def calculateBorderPixels(self):
         """
         Calculates poor man's border pixels, i.e. pixels which are not completely surrounded by other of the CC's pixels.
         The border pixels are calculated because only they need to be examined e.g. when calculating a distance
         between two CCs.
+
+        The border is what remains of the CC's mask after an erosion with a 3x3 square; the pixels are kept in the
+        order of the pixel list.
         :return:
         """
+        if len(self.pixelI) == 0:
+            self.borderPixels = numpy.zeros((0, 2), dtype=numpy.int32)
+            return
 
-        for i in range(0, len(self.pixelList)):
-            count = 0  # count = 8 if surrounded
-            found = False
-            (a,b) = self.pixelList[i]
-
-            for j in range(a-1, a+2):
-                for k in range(b-1, b+2):
-
-                    for t in range(0, len(self.pixelList)):
-                        if (a == j and b == k):
-                            continue #let's not test the pixel on itself.
-                        t1,t2 = self.pixelList[t]
-                        if j==t1 and k==t2:
-                            count = count +1
-                            break
-
-                    if (count == 8):
-                        found = True
-                        break
-                if (found == True):
-                    break
+        mask = self.getMask(1)
+        interior = ndimage.binary_erosion(mask, structure=EIGHT_CONNECTED)
+        isBorder = ~interior[self.pixelI-self.iMin+1, self.pixelJ-self.jMin+1]
 
-            if (found == False):
-                self.borderPixels.append( self.pixelList[i] )
+        self.borderPixels = numpy.column_stack((self.pixelI[isBorder], self.pixelJ[isBorder]))
 
     def getMinMax(self):
         """
         Returns the minimum and maximum i and j coordinates of the CC. (imin, imax, jmin, jmax).
         :return:
         """
-        if self.iMin == -1:
-            self.calculateMinMax()
         return (self.iMin, self.iMax, self.jMin, self.jMax)
 
     def calculateMinMax(self):
@@ -154,34 +349,436 @@ class ConnectedComponent():
         Calculates the minimum and maximum i and j coordinates of the CC.
         :return:
         """
-        jmax = 0
-        jmin = 1000000
-        imax = 0
-        imin = 1000000
+        if len(self.pixelI) == 0:
+            (self.iMin, self.iMax, self.jMin, self.jMax) = (1000000, 0, 1000000, 0)
+            return
+
+        self.iMin = int(self.pixelI.min())
+        self.iMax = int(self.pixelI.max())
+        self.jMin = int(self.pixelJ.min())
+        self.jMax = int(self.pixelJ.max())
+
+
+class ComponentLabelling():
+    """
+    Labels the 8-connected components of a binarised image in a single array-based pass, and holds the label image
+    together with per-component statistics: pixel count, bounding box and centroid.
+
+    Label 0 is the background; components are labelled 1..n in the raster order of their first pixel. The pixel
+    coordinates of all components are kept sorted by label (and in raster order within a label), so that a component
+    can be materialised from two array slices.
+    """
+
+    def __init__(self, binImg):
+        self.labels, self.count = ndimage.label(binImg == 0, structure=EIGHT_CONNECTED)
+
+        ii, jj = numpy.nonzero(self.labels)
+        lab = self.labels[ii, jj]
+        order = numpy.argsort(lab, kind='stable')  # stable: keeps the raster order within a component
+        self.pixelI = ii[order].astype(numpy.int32)
+        self.pixelJ = jj[order].astype(numpy.int32)
+
+        self.pixelCounts = numpy.bincount(lab, minlength=self.count+1)
+        self.starts = numpy.zeros(self.count+2, dtype=numpy.int64)
+        numpy.cumsum(self.pixelCounts[1:], out=self.starts[2:])
+
+        if self.count > 0:
+            firsts = self.starts[1:-1]
+            self.iMin = numpy.minimum.reduceat(self.pixelI, firsts)
+            self.iMax = numpy.maximum.reduceat(self.pixelI, firsts)
+            self.jMin = numpy.minimum.reduceat(self.pixelJ, firsts)
+            self.jMax = numpy.maximum.reduceat(self.pixelJ, firsts)
+            self.centroidI = numpy.add.reduceat(self.pixelI, firsts, dtype=numpy.int64) / self.pixelCounts[1:]
+            self.centroidJ = numpy.add.reduceat(self.pixelJ, firsts, dtype=numpy.int64) / self.pixelCounts[1:]
+        else:
+            self.iMin = self.iMax = self.jMin = self.jMax = numpy.zeros(0, dtype=numpy.int32)
+            self.centroidI = self.centroidJ = numpy.zeros(0)
+
+    def getLabels(self):
+        return self.labels
+
+    def getCount(self):
+        return self.count
+
+    def getPixelCount(self, label):
+        return int(self.pixelCounts[label])
+
+    def getMinMax(self, label):
+        """
+        Returns the bounding box of a labelled component as (imin, imax, jmin, jmax).
+        """
+        n = label-1
+        return (int(self.iMin[n]), int(self.iMax[n]), int(self.jMin[n]), int(self.jMax[n]))
+
+    def getCentroid(self, label):
+        return (float(self.centroidI[label-1]), float(self.centroidJ[label-1]))
+
+    def getPixels(self, label):
+        """
+        Returns the (i, j) coordinate arrays of a labelled component in raster order.
+        """
+        s, e = self.starts[label], self.starts[label+1]
+        return self.pixelI[s:e], self.pixelJ[s:e]
+
+    def getComponent(self, label, seed=None):
+        """
+        Materialises a labelled component; if a seed pixel is given, it is placed first in the pixel list (as a flood
+        fill started from the seed would do).
+        """
+        ii, jj = self.getPixels(label)
+        if seed is not None and (ii[0], jj[0]) != seed:
+            k = numpy.nonzero((ii == seed[0]) & (jj == seed[1]))[0][0]
+            order = numpy.concatenate(([k], numpy.arange(0, k), numpy.arange(k+1, len(ii))))
+            ii = ii[order]
+            jj = jj[order]
+        return ConnectedComponent(None, ii, jj)
+
+    def getLabelsInWindow(self, startI, endI, startJ, endJ):
+        """
+        Returns the labels of the components that have pixels in the window, ordered by the raster order of their
+        first pixel inside the window (i.e. the order in which a scan of the window would encounter them), and a list
+        of those first pixels as (i, j) seeds.
+        """
+        window = self.labels[startI:endI, startJ:endJ]
+        if startI == 0 and startJ == 0 and window.shape == self.labels.shape:
+            labelList = numpy.arange(1, self.count+1)
+            return labelList, list(zip(self.pixelI[self.starts[1:-1]].tolist(), self.pixelJ[self.starts[1:-1]].tolist()))
+
+        found, firsts = numpy.unique(window.ravel(), return_index=True)
+        firsts = firsts[found != 0]
+        found = found[found != 0]
+        order = numpy.argsort(firsts)
+        firsts = firsts[order]
+        seeds = list(zip((firsts // window.shape[1] + startI).tolist(), (firsts % window.shape[1] + startJ).tolist()))
+        return found[order], seeds
+
+    def getLabelsAt(self, seeds):
+        """
+        Returns the distinct labels found at the given (i, j) seed pixels in the order of the seeds, and the seeds
+        they were first found at; background seeds are ignored.
+        """
+        labelList = []
+        foundSeeds = []
+        seen = set()
+        for (i, j) in seeds:
+            label = int(self.labels[i, j])
+            if label != 0 and label not in seen:
+                seen.add(label)
+                labelList.append(label)
+                foundSeeds.append((int(i), int(j)))
+        return labelList, foundSeeds
+
+    def clearComponents(self, binImg, labelList):
+        """
+        Whitens the pixels of the given components in binImg.
+        """
+        if len(labelList) == 0:
+            return binImg
+        if len(labelList) == self.count:
+            binImg[self.labels != 0] = 255
+        else:
+            binImg[numpy.isin(self.labels, labelList)] = 255
+        return binImg
+
+
+class ComponentIndex():
+    """
+    A uniform grid over the bounding boxes of connected components (or of anything with getMinMax(), e.g. lines),
+    for the neighbourhood queries that would otherwise compare every component with every other one.
+
+    Each inserted component gets an integer key. Keys grow in insertion order and queries return them sorted, so a
+    caller iterating the keys sees the components in the order of the list they were inserted from.
+
+    An item can also be inserted with an explicit bounding box (e.g. a set id of a ComponentMerger).
+    """
+
+    def __init__(self, ccList=None, cellSize=64):
+        self.cellSize = cellSize
+        self.cells = {}   # (cell i, cell j) -> list of keys
+        self.items = {}   # key -> component
+        self.boxes = {}   # key -> (imin, imax, jmin, jmax)
+        self.nextKey = 0
+        self.cellBounds = None  # (min cell i, max cell i, min cell j, max cell j) of what has been inserted
+
+        if ccList is not None:
+            for n in range(0, len(ccList)):
+                self.insert(ccList[n])
+
+    def insert(self, cc, box=None):
+        key = self.nextKey
+        self.nextKey += 1
+
+        if box is None:
+            box = cc.getMinMax()
+        self.items[key] = cc
+        self.boxes[key] = box
+
+        (ci1, ci2, cj1, cj2) = self.getCellRange(box)
+        for a in range(ci1, ci2+1):
+            for b in range(cj1, cj2+1):
+                self.cells.setdefault((a, b), []).append(key)
+
+        if self.cellBounds is None:
+            self.cellBounds = (ci1, ci2, cj1, cj2)
+        else:
+            (bi1, bi2, bj1, bj2) = self.cellBounds
+            self.cellBounds = (min(bi1, ci1), max(bi2, ci2), min(bj1, cj1), max(bj2, cj2))
+
+        return key
+
+    def remove(self, key):
+        box = self.boxes.pop(key)
+        del self.items[key]
+
+        (ci1, ci2, cj1, cj2) = self.getCellRange(box)
+        for a in range(ci1, ci2+1):
+            for b in range(cj1, cj2+1):
+                self.cells[(a, b)].remove(key)
+
+    def getItem(self, key):
+        return self.items[key]
+
+    def getMinMax(self, key):
+        return self.boxes[key]
+
+    def getKeys(self):
+        return sorted(self.items)
+
+    def getCount(self):
+        return len(self.items)
+
+    def getCellRange(self, box):
+        (imin, imax, jmin, jmax) = box
+        c = self.cellSize
+        return (int(imin)//c, int(imax)//c, int(jmin)//c, int(jmax)//c)
+
+    def queryBox(self, imin, imax, jmin, jmax):
+        """
+        Returns the sorted keys of the components whose bounding boxes intersect the given box (inclusive).
+        """
+        if self.cellBounds is None or imin > imax or jmin > jmax:
+            return []
+
+        (bi1, bi2, bj1, bj2) = self.cellBounds
+        (ci1, ci2, cj1, cj2) = self.getCellRange((max(imin, bi1*self.cellSize), min(imax, (bi2+1)*self.cellSize),
+                                                  max(jmin, bj1*self.cellSize), min(jmax, (bj2+1)*self.cellSize)))
+        found = set()
+        for a in range(ci1, ci2+1):
+            for b in range(cj1, cj2+1):
+                for key in self.cells.get((a, b), ()):
+                    if key in found:
+                        continue
+                    (i1, i2, j1, j2) = self.boxes[key]
+                    if i1 <= imax and i2 >= imin and j1 <= jmax and j2 >= jmin:
+                        found.add(key)
+
+        return sorted(found)
+
+    def queryRowBand(self, a, b):
+        """
+        Returns the sorted keys of the components overlapping the row band [a, b].
+        """
+        if self.cellBounds is None:
+            return []
+        return self.queryBox(a, b, self.cellBounds[2]*self.cellSize, (self.cellBounds[3]+1)*self.cellSize)
+
+    def queryColumnBand(self, a, b):
+        """
+        Returns the sorted keys of the components overlapping the column band [a, b].
+        """
+        if self.cellBounds is None:
+            return []
+        return self.queryBox(self.cellBounds[0]*self.cellSize, (self.cellBounds[1]+1)*self.cellSize, a, b)
+
+    def queryDistance(self, cc, distance):
+        """
+        Returns the sorted keys of the components whose bounding boxes are within the given (Euclidean) distance of
+        cc's bounding box. As the bounding boxes are never further apart than the pixels, the result is a superset of
+        the components whose pixels are within the distance.
+        """
+        return self.queryBoxDistance(cc.getMinMax(), distance)
+
+    def queryBoxDistance(self, box, distance):
+        """
+        Returns the sorted keys of the components whose bounding boxes are within the given distance of the box.
+        """
+        (imin, imax, jmin, jmax) = box
+        d = int(math.ceil(distance))
+        ret = []
+        for key in self.queryBox(imin-d, imax+d, jmin-d, jmax+d):
+            if getBoxDistance((imin, imax, jmin, jmax), self.boxes[key]) <= distance:
+                ret.append(key)
+        return ret
+
+    def nearestLeft(self, cc):
+        """
+        Returns the key of the nearest component entirely to the left of cc and overlapping its rows; None if none.
+        """
+        (imin, imax, jmin, jmax) = cc.getMinMax()
+        if self.cellBounds is None:
+            return None
+
+        best = None
+        bestJ = None
+        c = self.cellSize
+        for b in range(min(int(jmin)//c, self.cellBounds[3]), self.cellBounds[2]-1, -1):
+            for key in self.queryBox(imin, imax, b*c, b*c+c-1):
+                j2 = self.boxes[key][3]
+                if j2 < jmin and (bestJ is None or j2 > bestJ or (j2 == bestJ and key < best)):
+                    best = key
+                    bestJ = j2
+            # Components further left all end before this strip.
+            if bestJ is not None and bestJ >= b*c:
+                break
+        return best
+
+    def nearestBelow(self, cc):
+        """
+        Returns the key of the nearest component entirely below cc and overlapping its columns; None if none.
+        """
+        (imin, imax, jmin, jmax) = cc.getMinMax()
+        if self.cellBounds is None:
+            return None
+
+        best = None
+        bestI = None
+        c = self.cellSize
+        for a in range(max(int(imax)//c, self.cellBounds[0]), self.cellBounds[1]+1):
+            for key in self.queryBox(a*c, a*c+c-1, jmin, jmax):
+                i1 = self.boxes[key][0]
+                if i1 > imax and (bestI is None or i1 < bestI or (i1 == bestI and key < best)):
+                    best = key
+                    bestI = i1
+            # Components further down all start after this strip.
+            if bestI is not None and bestI <= a*c+c-1:
+                break
+        return best
+
+
+class ComponentMerger():
+    """
+    Merges connected components as disjoint sets, instead of concatenating their pixels into a new CC at every merge.
+
+    The CCs of the given list are the initial sets, identified by their positions in the list. union() joins two sets
+    in near-constant time (union by size, path halving) and keeps the bounding box and the pixel count of the joined
+    set up to date. The pixels of a merged CC are materialised only when getComponent() is called; the members of a
+    set are kept in merge order, so the pixels come in the order a concatenation of the pixel lists would give.
+    """
+
+    def __init__(self, ccList):
+        n = len(ccList)
+        self.ccList = ccList
+        self.parents = list(range(n))
+        self.sizes = [1]*n         # member counts of the sets (for union by size)
+        self.heads = list(range(n))  # first member of a set
+        self.tails = list(range(n))  # last member of a set
+        self.nexts = [-1]*n        # next member in the set; -1 at the tail
+        self.boxes = [ccList[k].getMinMax() for k in range(n)]
+        self.pixelCounts = [ccList[k].getPixelCount() for k in range(n)]
+        self.components = {}       # root -> materialised merged CC
+
+    def find(self, k):
+        parents = self.parents
+        while parents[k] != k:
+            parents[k] = parents[parents[k]]
+            k = parents[k]
+        return k
+
+    def union(self, a, b):
+        """
+        Joins the sets of a and b; the members of a's set precede the ones of b's.
+        :return: the id (root) of the joined set
+        """
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+
+        root, child = (a, b) if self.sizes[a] >= self.sizes[b] else (b, a)
+        self.parents[child] = root
+        self.sizes[root] += self.sizes[child]
+
+        self.nexts[self.tails[a]] = self.heads[b]
+        self.heads[root] = self.heads[a]
+        self.tails[root] = self.tails[b]
+
+        (imin1, imax1, jmin1, jmax1) = self.boxes[a]
+        (imin2, imax2, jmin2, jmax2) = self.boxes[b]
+        self.boxes[root] = (min(imin1, imin2), max(imax1, imax2), min(jmin1, jmin2), max(jmax1, jmax2))
+        self.pixelCounts[root] = self.pixelCounts[a] + self.pixelCounts[b]
+
+        self.components.pop(a, None)
+        self.components.pop(b, None)
+        return root
+
+    def getMinMax(self, k):
+        return self.boxes[self.find(k)]
+
+    def getPixelCount(self, k):
+        return self.pixelCounts[self.find(k)]
+
+    def getMembers(self, k):
+        """
+        Returns the CCs of the set of k in merge order.
+        """
+        members = []
+        m = self.heads[self.find(k)]
+        while m != -1:
+            members.append(self.ccList[m])
+            m = self.nexts[m]
+        return members
+
+    def getComponent(self, k):
+        """
+        Returns the (materialised) CC of the set of k.
+        """
+        root = self.find(k)
+        if self.sizes[root] == 1:
+            return self.ccList[root]
 
-        for x in range(0, len(self.pixelList)):
-            (i, j) = self.pixelList[x]
-            if imax < i:
-                imax = i
-            if imin > i:
-                imin = i
-            if jmax < j:
-                jmax = j
-            if jmin > j:
-                jmin = j
+        if root not in self.components:
+            members = self.getMembers(root)
+            self.components[root] = ConnectedComponent(None, numpy.concatenate([cc.getPixels()[0] for cc in members]),
+                                                       numpy.concatenate([cc.getPixels()[1] for cc in members]))
+        return self.components[root]
 
-        self.iMin = imin
-        self.iMax = imax
-        self.jMin = jmin
-        self.jMax = jmax
+    def getDistance(self, a, b, maxDistance=None):
+        """
+        calculateCCDistance2() between the sets of a and b without materialising them: the minimum distance between
+        two unions of disjoint CCs is the minimum over their member pairs.
+        """
+        bound = numpy.inf if maxDistance is None else math.floor(maxDistance) + 0.5
+        minDist = None
+        for cc1 in self.getMembers(a):
+            for cc2 in self.getMembers(b):
+                if getBoxDistance(cc1.getMinMax(), cc2.getMinMax()) >= bound:
+                    continue
+                dist = calculateCCDistance2(cc1, cc2, maxDistance)
+                if minDist is None or dist < minDist:
+                    minDist = dist
+        if minDist is None:
+            return maxDistance + 1
+        return minDist
 
 
-def findConnectedComponents(binImg, minimumSize = 0, findUntil = -1, startI =-1, endI = -1, startJ = -1, endJ = -1):
+def getBoxDistance(box1, box2):
+    """
+    Returns the Euclidean distance between two (imin, imax, jmin, jmax) bounding boxes; 0 if they overlap.
+    """
+    di = max(0, box2[0]-box1[1], box1[0]-box2[1])
+    dj = max(0, box2[2]-box1[3], box1[2]-box2[3])
+    return math.sqrt(di*di + dj*dj)
+
+
+def findConnectedComponents(binImg, minimumSize = 0, findUntil = -1, startI =-1, endI = -1, startJ = -1, endJ = -1, labelling=None):
     """
     Identifies Connected Components in a binarised image.
+    Note: as before, the components that are found (also the ones below minimumSize) are cleared from binImg.
     :param binImg: binarised image array
     :param minimumSize: omits returning connected components with a pixel count less than required
     :param findUntil is only used in situations, where one needs to find that more than a given nbr of CCs exist in the area
+    :param labelling: optionally, a ComponentLabelling to reuse (e.g. Facsimile.getLabelling()); it must be of binImg
+        or of an image binImg was derived from by clearing whole components only
     :return: a list of connected components
     """
     ccList = []
@@ -193,55 +790,81 @@ def findConnectedComponents(binImg, minimumSize = 0, findUntil = -1, startI =-1,
         startJ = 0
         endJ = binImg.shape[1]
 
-    # Let's look for black pixels; when encountered, ...
-    for i in range(startI, endI):
-        for j in range(startJ, endJ):
+    if labelling is None:
+        labelling = ComponentLabelling(binImg)
+    labelList, seeds = labelling.getLabelsInWindow(startI, endI, startJ, endJ)
+    labelList, seeds = dropClearedComponents(binImg, labelList, seeds)
 
-            if binImg[i, j] == 0:
-                # Found black pixel.
-                binImg, foundCC = findCC(binImg, i, j, minimumSize)
+    # Let's go through the components in the order a scan of the window would find them.
+    for n in range(0, len(labelList)):
+        label = labelList[n]
+        if labelling.getPixelCount(label) > minimumSize:
+            ccList.append(labelling.getComponent(label, seeds[n]))
 
-                if (foundCC != None):
-                    ccList.append(foundCC)
+            if findUntil != -1:
+                if len(ccList) > findUntil:
+                    labelList = labelList[:n+1]
+                    break
 
-                    if findUntil != -1:
-                        if len(ccList) > findUntil:
-                            return ccList
+    labelling.clearComponents(binImg, labelList)
+    return ccList
 
+
+def findSeededComponents(binImg, seeds, labelling=None):
+    """
+    Finds the connected components which contain the given (i, j) seed pixels; clears them from binImg.
+    Components are returned in the order of the seeds; a component is returned only once.
+    Used by findCC2() and findBorderMostConnectedComponents().
+    :param binImg: binarised image array
+    :param seeds: an iterable of (i, j) pixel positions
+    :param labelling: optionally, a ComponentLabelling to reuse; see findConnectedComponents()
+    :return: a list of connected components
+    """
+    if labelling is None:
+        labelling = ComponentLabelling(binImg)
+    labelList, seeds = labelling.getLabelsAt(seeds)
+    labelList, seeds = dropClearedComponents(binImg, labelList, seeds)
+
+    ccList = []
+    for n in range(0, len(labelList)):
+        ccList.append(labelling.getComponent(labelList[n], seeds[n]))
+
+    labelling.clearComponents(binImg, labelList)
     return ccList
 
 
+def dropClearedComponents(binImg, labelList, seeds):
+    """
+    Drops the components whose seed pixel is no longer black in binImg, i.e. the ones that have been cleared since
+    a (reused) labelling was made.
+    :return: the remaining labels and seeds
+    """
+    if len(seeds) == 0:
+        return labelList, seeds
+
+    seedArray = numpy.array(seeds).reshape(-1, 2)
+    live = binImg[seedArray[:, 0], seedArray[:, 1]] == 0
+    if live.all():
+        return labelList, seeds
+
+    labelList = numpy.asarray(labelList)[live]
+    seeds = [seeds[n] for n in numpy.nonzero(live)[0]]
+    return labelList, seeds
+
+
 def findCC(binImg, i, j, minimumSize):
     """
-    Starts to search for a Connected Component from the given pixel position onwards;
-    searches all adjacent pixels (eight-connected).
+    Returns the Connected Component found from the given pixel position (eight-connected), and clears it from binImg.
     :param binImg: binarised image array
     :param i: where to start inspection
     :param j: where to start inspection
     :param minimumSize: a threshold for accepting a found CC
     :return:
     """
-    searchDistance = 1  # Default for CC's would be 1
-    pixelList = []
-
-    toCheck = set()
-    toCheck.add((i, j))
-
-    while not len(toCheck) == 0:
-        (i, j) = toCheck.pop()
-        if (binImg[i, j] == 255):
-            continue
-        binImg[i, j] = 255
-        pixelList.append((i, j))
-
-        for x in range((searchDistance * -1), searchDistance + 1):
-            for y in range((searchDistance * -1), searchDistance + 1):
-                if (i + x < binImg.shape[0] and j + y < binImg.shape[1] and i + x >= 0 and j + y >= 0):
-                    toCheck.add((i + x, j + y))
-
     ret = None
-    if len(pixelList) > minimumSize:
-        ret = ConnectedComponent(pixelList)
+    ccList = findSeededComponents(binImg, [(i, j)])
+    if len(ccList) > 0 and ccList[0].getPixelCount() > minimumSize:
+        ret = ccList[0]
 
     return binImg, ret
 
@@ -249,78 +872,91 @@ def findCC(binImg, i, j, minimumSize):
 def findCC2(binImg, toCheckIn):
     """
     A variant of findCC(). (@redundant code; poor naming, etc.).
-    Used by cleanBorders() and findBorderMostCC().
+    Returns an empty CC if the seed pixel is not black.
     :param binImg:
     :param toCheckIn:
     :return:
     """
-    searchDistance = 1  # Default for CC's would be 1
-    pixelList = []
+    ccList = findSeededComponents(binImg, [toCheckIn])
+    if len(ccList) == 0:
+        return ConnectedComponent([])
+    return ccList[0]
 
-    toCheck = set()
-    toCheck.add(toCheckIn)
 
-    while not len(toCheck) == 0:
-        (j, i) = toCheck.pop()
-        if (binImg[j, i] == 255):
-            continue
-        binImg[j, i] = 255
-        pixelList.append((j, i))
+def calculateCCDistance2(p1, p2, maxDistance=None):
+    """
+    Calculates a minimum distance between two CCs from their border pixels, rounded to the nearest integer.
+    The nearest neighbours of p1's border pixels are looked up from a KD-tree over p2's border pixels (cached on p2).
 
-        for x in range((searchDistance * -1), searchDistance + 1):
-            for y in range((searchDistance * -1), searchDistance + 1):
-                if (j + x < binImg.shape[0] and i + y < binImg.shape[1] and j + x >= 0 and i + y >= 0):
-                    toCheck.add((j + x, i + y))
+    If maxDistance is given, the search stops early: any distance over maxDistance is returned as maxDistance+1.
+    Use it when only "is the distance <= maxDistance?" matters.
+    """
+    # A rounded distance is at most maxDistance iff the distance is less than this bound.
+    bound = numpy.inf
+    if maxDistance is not None:
+        bound = math.floor(maxDistance) + 0.5
+        if getBoxDistance(p1.getMinMax(), p2.getMinMax()) >= bound:
+            return maxDistance + 1
+
+    # Let's query with the smaller set of border pixels against the tree of the larger one.
+    if len(p1.getBorderPixels()) > len(p2.getBorderPixels()):
+        p1, p2 = p2, p1
+
+    pixels1 = p1.getBorderPixels()
+    if len(pixels1) == 0 or len(p2.getBorderPixels()) == 0:
+        return 10000000
+
+    # Only the pixels near p2's bounding box can be within the bound.
+    if bound != numpy.inf:
+        (imin, imax, jmin, jmax) = p2.getMinMax()
+        di = numpy.maximum(0, numpy.maximum(imin - pixels1[:, 0], pixels1[:, 0] - imax))
+        dj = numpy.maximum(0, numpy.maximum(jmin - pixels1[:, 1], pixels1[:, 1] - jmax))
+        pixels1 = pixels1[(di.astype(numpy.int64)**2 + dj.astype(numpy.int64)**2) < bound*bound]
+        if len(pixels1) == 0:
+            return maxDistance + 1
 
-    return ConnectedComponent(pixelList)
+    dist, nearest = p2.getBorderTree().query(pixels1, k=1, distance_upper_bound=bound)
+    minDist = dist.min()
 
+    if minDist == numpy.inf:
+        return maxDistance + 1
 
-def calculateCCDistance2(p1, p2):
+    return int(round(minDist))
+
+
+def cropArea(area, imin, imax, jmin, jmax):
     """
-    Calculates a minimum distance between two CCs by examining all of their border pixels (poor).
+    Returns the region [imin, imax) x [jmin, jmax) of an image array, as PIL's crop() would: parts outside the
+    image are black. A region within the image is returned as a slice (a view of area, no copy).
+    :param area: image array
+    :return: image array
     """
-    pixels1 = p1.getBorderPixels()
-    pixels2 = p2.getBorderPixels()
+    (imin, imax, jmin, jmax) = (int(round(imin)), int(round(imax)), int(round(jmin)), int(round(jmax)))
+    if imax < imin or jmax < jmin:
+        raise ValueError("Invalid crop region: " + str((imin, imax, jmin, jmax)))
 
-    minDist = 10000000
+    (h, w) = area.shape[0:2]
+    if imin >= 0 and jmin >= 0 and imax <= h and jmax <= w:
+        return area[imin:imax, jmin:jmax]
 
-    for x in range(0, len(pixels1)):
-        for y in range(0, len(pixels2)):
-            c11, c12 = pixels1[x]
-            c21, c22 = pixels2[y]
-            dist = int(round(math.sqrt(math.pow((c11 - c21), 2) + math.pow((c12 - c22), 2))))
-            if (minDist > dist):
-                minDist = dist
+    cropped = numpy.zeros((imax - imin, jmax - jmin) + area.shape[2:], dtype=area.dtype)
+    (i1, i2, j1, j2) = (max(imin, 0), min(imax, h), max(jmin, 0), min(jmax, w))
+    if i1 < i2 and j1 < j2:
+        cropped[i1-imin:i2-imin, j1-jmin:j2-jmin] = area[i1:i2, j1:j2]
+    return cropped
 
-    return minDist
 
-
-def getProjections(facs, facsName, visualise=True):
+def getProjections(facs, facsName, visualise=True, region=None):
     """
     Calculates horizontal and vertical projections and optionally visualises the normalised distributions by
     expanding the input image with [+101, +101] pixels.
 
+    The pixel counts are read from the facsimile's summed-area table; with a region (imin, imax, jmin, jmax), the
+    projections of that part of the image are calculated without cropping it.
+
     Returns normalised lists of projection's pixel counts and the generated image.
     """
-    img = facs.getImage()
-    verticalList = []
-    horizontalList = []
-
-    # Calculates vertical pixel counts across the image.
-    for j in range(0, img.shape[1]):
-        count = 0
-        for i in range(0, img.shape[0]):
-            if (img[i, j] == 0):
-                count = count + 1
-        verticalList.append(count)
-
-    # Calculates horizontal pixel counts down the image.
-    for i in range(0, img.shape[0]):
-        count = 0
-        for j in range(0, img.shape[1]):
-            if (img[i, j] == 0):
-                count = count + 1
-        horizontalList.append(count)
+    (horizontalList, verticalList) = facs.getProjectionCounts(region)
 
     # Normalises the lists.
     normHorList = fu.normaliseList(horizontalList)
@@ -329,12 +965,16 @@ def getProjections(facs, facsName, visualise=True):
     # (i,j) = img.shape
 
     if (visualise):
+        img = facs.getImage()
+        if region is not None:
+            img = img[region[0]:region[1], region[2]:region[3]]
+
         # Creates a new image on which the projection profiles are visualised.
         # Kludge: Using PIL to create an image because, for reasons I'm too tired to debug, image saving fails if the
         # array is created with np.zeros().
         # (proj = numpy.zeros((i+101,j+101), dtype=np.int))
         # im = Image.new('L', (j+101,i+101), 255)
-        im = Image.new("RGB", (j + 101, i + 101), "white")
+        im = Image.new("RGB", (img.shape[1] + 100, img.shape[0] + 100), "white")
         proj = numpy.array(im)
 
         # Pastes in the existing image.
@@ -457,19 +1097,19 @@ def cropBorderShadows(binFacs, facsName):
     tempArray = binFacs.getImage()
     bi,bj = tempArray.shape
 
-    for j in range(0, 50):
+    for j in range(0, borderBandWidth):
         for i in range(0, bi):
             tempArray[i][j] = 0
 
-    for j in range(bj-51, bj):
+    for j in range(bj-borderBandWidth-1, bj):
         for i in range(0, bi):
            tempArray[i][j] = 0
 
-    for i in range(0, 50):
+    for i in range(0, borderBandWidth):
         for j in range(0, bj):
             tempArray[i][j] = 0
 
-    for i in range(bi-51, bi):
+    for i in range(bi-borderBandWidth-1, bi):
         for j in range(0, bj):
             tempArray[i][j] = 0
 
@@ -481,22 +1121,16 @@ def cropBorderShadows(binFacs, facsName):
     (normHorList, normVerList, binarisedProj) = getProjections(tempFacs, 'binarisedProj', False)
 
     # Let's find the coordinates after the peaks which are assumed to be present in every edge.
-    # Let's eat away 50px more. todo: the names are wrong way. cropTop = left, etc.
-    cropTop = getCutoffIndex(normVerList, 0) + 50
-    cropBot = getReverseCutoffIndex(normVerList, len(normVerList) - 1) - 50
-    cropLeft = getCutoffIndex(normHorList, 0) + 50
-    cropRight = getReverseCutoffIndex(normHorList, len(normHorList) - 1) - 50
-
-    # Get the image to work with; PIL is used to create the image and to perform the crop.
-    tempImage = Image.fromarray(binFacs.getImage())
+    # Let's eat away borderCropMargin px more. todo: the names are wrong way. cropTop = left, etc.
+    cropTop = getCutoffIndex(normVerList, 0) + borderCropMargin
+    cropBot = getReverseCutoffIndex(normVerList, len(normVerList) - 1) - borderCropMargin
+    cropLeft = getCutoffIndex(normHorList, 0) + borderCropMargin
+    cropRight = getReverseCutoffIndex(normHorList, len(normHorList) - 1) - borderCropMargin
 
     # Crop the image according to the region we specified by searching for the cutoff points.
-    box = (cropTop, cropLeft, cropBot, cropRight)
-    croppedRegion = tempImage.crop(box)
-
-    # Creating a new Facsimile
     binOffset = binFacs.getOffset()
-    remBorders = Facsimile(numpy.array(croppedRegion), facsName, (cropLeft + binOffset[0], cropTop + binOffset[1]))
+    remBorders = binFacs.getRegion(cropLeft, cropRight, cropTop, cropBot, facsName,
+                                   (cropLeft + binOffset[0], cropTop + binOffset[1]))
     if Levers.debugFlag:
         remBorders.save()
 
@@ -543,6 +1177,7 @@ def extractPages(remBorders):
     :param remBorders:
     :return:
     """
+    (height, width) = remBorders.getShape()
     tempFacs = Facsimile(remBorders.getImage(), 'tempFacs', remBorders.getOffset())
     # Generates a temp image, where textual content detected in the middle is removed (whitened).
     tempFacs = prepareSpread(tempFacs)
@@ -562,8 +1197,8 @@ def extractPages(remBorders):
     page1End = getReverseCutoffIndex(normVerList, peakIndex)
 
     # Requirement: peakIndex +-10% from the spread's horizontal centre-point.
-    window = remBorders.getImage().shape[1] / 10
-    centrepoint = int(remBorders.getImage().shape[1] / 2)
+    window = width / 10
+    centrepoint = int(width / 2)
 
     if (abs(centrepoint - peakIndex) > window):
         print ("WARNING. There is an indication that gutter shadow was not detected correctly. Using mathematical centrepoint for page cutting.")
@@ -571,17 +1206,10 @@ def extractPages(remBorders):
         page2Start = centrepoint + 1
 
     # Let's crop the page images.
-    crp = Image.fromarray(remBorders.getImage())
-    p1 = (0, 0, page1End, remBorders.getImage().shape[0])
-    p2 = (page2Start, 0, remBorders.getImage().shape[1], remBorders.getImage().shape[0])
-
-    pag1 = crp.crop(p1)
-    pag2 = crp.crop(p2)
-
     rbOffset = remBorders.getOffset()
 
-    page1Img = Facsimile(numpy.array(pag1), 'page1Img', (rbOffset[0], rbOffset[1]))
-    page2Img = Facsimile(numpy.array(pag2), 'page2Img', (rbOffset[0], page2Start + rbOffset[1]))
+    page1Img = remBorders.getRegion(0, height, 0, page1End, 'page1Img', (rbOffset[0], rbOffset[1]))
+    page2Img = remBorders.getRegion(0, height, page2Start, width, 'page2Img', (rbOffset[0], page2Start + rbOffset[1]))
 
     if Levers.debugFlag:
         page1Img.save()
@@ -590,7 +1218,7 @@ def extractPages(remBorders):
     return [page1Img, page2Img]
 
 
-def applyMask(pageImg, facsName):
+def applyMask(pageImg, facsName, region=None):
     """
     Enhances the textual signal for further processing by bloating the text CCs with a mask.
     The idea is to fill small white regions in-between text, and thus strengthen the profile signal of the text area.
@@ -598,16 +1226,15 @@ def applyMask(pageImg, facsName):
     characters vertically.
     :param pageImg:
     :param facsName:
+    :param region: optionally, (imin, imax, jmin, jmax): the mask is run through that region only, as if it were the
+        whole image; the pixels outside it are neither read nor changed
     :return:
     """
     img = pageImg.getImage()
+    area = img if region is None else img[region[0]:region[1], region[2]:region[3]]
 
-    # Let's run the mask through the image. The central pixel is changed only if both left and right regions contain ink.
-    for j in range(0, img.shape[1]):
-        for i in range(0, img.shape[0]):
-            if (img[i, j] == 255):
-                if (searchBlack(img, i - 1, j - 4) and searchBlack(img, i - 1, j + 1)):
-                    img[i, j] = 0
+    # The central pixel is changed only if both left and right regions (3x4 px) contain ink.
+    calculateMask(area)
 
     maskedPage = Facsimile(img, facsName, pageImg.getOffset())
     if Levers.debugFlag:
@@ -616,18 +1243,57 @@ def applyMask(pageImg, facsName):
     return maskedPage
 
 
-def searchBlack(img, i, jin):
+def calculateMask(area):
     """
-    Searches for a region for black pixels. If found, returns True; else False.
-    Used by applyMask().
+    Runs the bloating mask of applyMask() through the array in place: a white pixel is blackened if there is ink both
+    in the 3x4 px region on its left and in the one on its right.
+
+    The mask used to be run through the array column by column, so the ink it had added on the left was already seen
+    by the following columns, whereas the right-hand region was always as in the input. Here, the right-hand regions
+    are a whole-array windowed-OR map of the input ink; the left-hand regions are ORed from the vertically dilated
+    columns before each column, which are updated as ink is added. Only the columns with candidate pixels are visited.
     """
-    for i in range(i, i + 3):
-        j = jin
-        for j in range(j, j + 4):
-            if (i >= 0 and i < img.shape[0] and j >= 0 and j < img.shape[1]):
-                if (img[i, j] == 0):
-                    return True
-    return False
+    ink = (area == 0)
+    candidates = (area == 255) & getWindowInk(ink, -1, 1, 1, 4)
+
+    # Column-wise (transposed, to make the columns contiguous): the ink of each column dilated by a px up and down.
+    dilated = numpy.ascontiguousarray(getWindowInk(ink, -1, 1, 0, 0).T)
+    candidates = candidates.T
+    added = numpy.zeros(dilated.shape, dtype=bool)
+
+    for j in numpy.nonzero(candidates.any(axis=1))[0]:
+        if j == 0:
+            continue
+        new = candidates[j] & dilated[max(0, j-4):j].any(axis=0)
+        if new.any():
+            added[j] = new
+            dilated[j, :-1] |= new[1:]
+            dilated[j] |= new
+            dilated[j, 1:] |= new[:-1]
+
+    area[added.T] = 0
+    return area
+
+
+def getWindowInk(ink, i1, i2, j1, j2):
+    """
+    Returns a boolean array telling, for every pixel (i, j), whether the region of rows i+i1..i+i2 and columns
+    j+j1..j+j2 (inclusive; clipped to the array) contains ink.
+    :param ink: a boolean array
+    """
+    (h, w) = ink.shape
+    p = max(abs(i1), abs(i2), abs(j1), abs(j2))
+
+    # A summed-area table of the ink zero-padded by p px on every side.
+    table = numpy.zeros((h+2*p+1, w+2*p+1), dtype=numpy.int32)
+    table[p+1:p+1+h, p+1:p+1+w] = ink
+    numpy.cumsum(table, axis=0, out=table)
+    numpy.cumsum(table, axis=1, out=table)
+
+    top = table[p+i1:p+i1+h]
+    bottom = table[p+i2+1:p+i2+1+h]
+    count = bottom[:, p+j2+1:p+j2+1+w] - bottom[:, p+j1:p+j1+w] - top[:, p+j2+1:p+j2+1+w] + top[:, p+j1:p+j1+w]
+    return count > 0
 
 
 def cleanBorders(facsIn):
@@ -637,27 +1303,11 @@ def cleanBorders(facsIn):
     :return:
     """
     binImg = facsIn.getImage()
-    (i, j) = binImg.shape
-
-    ccList = []
-    toCheck = set()
-
-    for x in range(0, i):
-        if (binImg[x, 0] == 0):
-            toCheck.add((x, 0))
-
-    for x in range(0, i):
-        if (binImg[x, j - 1] == 0):
-            toCheck.add((x, j - 1))
 
-    while not len(toCheck) == 0:
-        ccList.append(findCC2(binImg, toCheck.pop()))
-
-    for x in range(0, len(ccList)):
-        l = ccList[x].getPixelList()
-        for y in range(0, len(l)):
-            (a, b) = l[y]
-            binImg[a, b] = 255
+    labelling = ComponentLabelling(binImg)
+    labels = labelling.getLabels()
+    edgeLabels = numpy.union1d(labels[:, 0], labels[:, -1])
+    labelling.clearComponents(binImg, edgeLabels[edgeLabels != 0])
 
     ret = Facsimile(binImg, facsIn.imageType + "Cleaned", facsIn.getOffset())
     return ret
@@ -671,15 +1321,16 @@ def cleanBorders2(arrayIn):
     """
 
     filterList = []
+    labelling = ComponentLabelling(arrayIn)
 
-    leftMostCC = findBorderMostConnectedComponents(arrayIn.copy(), 'left')
+    leftMostCC = findBorderMostConnectedComponents(arrayIn.copy(), 'left', labelling=labelling)
     for i in range(0, len(leftMostCC)):
         imin,imax,jmin,jmax = leftMostCC[i].getMinMax()
         if jmin<6:
             if jmax-jmin < 10:
                 filterList.append(leftMostCC[i])
 
-    rightMostCC = findBorderMostConnectedComponents(arrayIn.copy(), 'right')
+    rightMostCC = findBorderMostConnectedComponents(arrayIn.copy(), 'right', labelling=labelling)
     for i in range(0, len(rightMostCC)):
         imin,imax,jmin,jmax = rightMostCC[i].getMinMax()
         if arrayIn.shape[1]-jmax < 6:
@@ -687,10 +1338,8 @@ def cleanBorders2(arrayIn):
                 filterList.append(rightMostCC[i])
 
     for i in range(0, len(filterList)):
-            pixList = filterList[i].getPixelList()
-            for j in range(0, len(pixList)):
-                a,b = pixList[j]
-                arrayIn[a][b] = 255
+        ii, jj = filterList[i].getPixels()
+        arrayIn[ii, jj] = 255
 
     return arrayIn
 
@@ -703,11 +1352,8 @@ def analyseSkewDetectionArea(facsIn):
     :return:
     """
     # Let's get top 20% of the masked page
-    pilImg = Image.fromarray(facsIn.getImage())
-    cropBox = (0, 0, facsIn.getImage().shape[1], int(facsIn.getImage().shape[0] * 0.20))
-    croppedRegion = pilImg.crop(cropBox)
-    topArea = numpy.array(croppedRegion)
-    topPart = Facsimile(topArea, 'skewDetectionArea', (0, 0))
+    (height, width) = facsIn.getShape()
+    topPart = facsIn.getRegion(0, int(height * 0.20), 0, width, 'skewDetectionArea', (0, 0))
     if Levers.debugFlag:
         topPart.save()
 
@@ -762,15 +1408,22 @@ def calculateDividerAngle(dividerCC):
     return divAngle
 
 
-def detectSkew(facsIn, topPart):
+def detectSkew(facsIn, topPart, coarseToFine=False, shear=False, workers=None):
     """
     Detects the skew from a partial area of the facsimile. The detection is based on a property of the normalised
     projection signal, where a sharper line detection lessens the total signal area.
     Note: Although this method worked alright with up to 90%-95%+ of cases, this is now secondary; a divider-based
     method gives more accurate results.
 
+    The candidate angles are scored concurrently (see calculateSkewScore()). By default, every candidate is scored at
+    full resolution, which gives the result of rotating and projecting the area at every angle in turn.
+
     :param facsIn:
     :param topPart:
+    :param coarseToFine: if True, the candidates are first scored on a 4x downsampled area, and only the best of them
+        and its neighbouring candidates are scored at full resolution (an approximation)
+    :param shear: if True, the ink pixels' coordinates are sheared instead of rotating the area (an approximation)
+    :param workers: the number of threads scoring the candidates; by default, one per candidate (up to the CPU count)
     :return:
     """
 
@@ -779,30 +1432,74 @@ def detectSkew(facsIn, topPart):
     # - If clearly delineated peaks are not found, then do not rotate the image at all.
     #   The first peak must be within a certain height, otherwise do not rotate? (i.e. detecting failure).
 
-    smallestSum = topPart.getImage().shape[0] * 100
+    smallestSum = topPart.image.shape[0] * 100
     bestAngle = -1
 
-    # Tests different angles.
+    # The angles to test. (Note: each quarter-degree angle used to be tested three times; once is enough.)
+    angles = []
     for i in range(-3, 2, 1):
         for j in range(0, 4): #2 to 4
             if (j == 0):
                 angle = i
             else:
                 angle = i + 0.25 #0.5 to 0.25
+            if angle not in angles:
+                angles.append(angle)
 
-            rotPart = rotateImage(topPart, angle, 'rotTopPart' + str(angle))
-            # rotPart.save()
+    ink = (topPart.image == 0)
 
-            (normHorList, normVerList, rotProj) = getProjections(rotPart, 'rotProj', None)
+    if coarseToFine:
+        (h, w) = (ink.shape[0] - ink.shape[0] % 4, ink.shape[1] - ink.shape[1] % 4)
+        coarseInk = ink[0:h, 0:w].reshape(h//4, 4, w//4, 4).any(axis=(1, 3))
+        coarseScores = scoreSkewAngles(coarseInk, angles, shear, workers)
+        best = coarseScores.index(min(coarseScores))
+        angles = angles[max(0, best-1):best+2]
 
-            if (sum(normHorList) < smallestSum):
-                smallestSum = sum(normHorList)
-                bestAngle = angle
+    scores = scoreSkewAngles(ink, angles, shear, workers)
+
+    # Tests different angles.
+    for n in range(0, len(angles)):
+        if (scores[n] < smallestSum):
+            smallestSum = scores[n]
+            bestAngle = angles[n]
 
     #print ("best angle:", bestAngle)
     return bestAngle
 
 
+def scoreSkewAngles(ink, angles, shear=False, workers=None):
+    """
+    Scores the given angles with calculateSkewScore() in a pool of threads (the rotation and the projection release
+    the GIL); returns the scores in the order of the angles.
+    """
+    if workers is None:
+        workers = min(len(angles), os.cpu_count() or 1)
+
+    if workers > 1 and len(angles) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda angle: calculateSkewScore(ink, angle, shear), angles))
+
+    return [calculateSkewScore(ink, angle, shear) for angle in angles]
+
+
+def calculateSkewScore(ink, angle, shear=False):
+    """
+    Returns the sum of the normalised horizontal projection of the ink (a boolean array) rotated by angle, as
+    rotateImage() would rotate it; the smaller, the sharper the lines.
+    With shear, the ink pixels' rows are sheared by the angle instead, i.e. the raster is not resampled.
+    """
+    if shear:
+        (h, w) = ink.shape
+        ii, jj = numpy.nonzero(ink)
+        rows = numpy.floor(ii + 0.5 - (jj + 0.5 - w/2.0) * math.tan(math.radians(angle))).astype(numpy.int64)
+        rowCounts = numpy.bincount(rows[(rows >= 0) & (rows < h)], minlength=h)
+    else:
+        rotated = numpy.asarray(Image.fromarray(ink.astype(numpy.uint8) * 255).rotate(angle))
+        rowCounts = numpy.count_nonzero(rotated, axis=1)
+
+    return sum(fu.normaliseList(rowCounts.tolist()))
+
+
 def rotateImage(facsIn, angle, facsName):
     """
     Rotates the input image according to the desired angle.
@@ -811,26 +1508,61 @@ def rotateImage(facsIn, angle, facsName):
     :param facsName:
     :return:
     """
-    # @rewrite.
-    arrayIn = facsIn.getImage()
-    for a in range(0, arrayIn.shape[0]):
-        for b in range(0, arrayIn.shape[1]):
-            if (arrayIn[a, b] == 0):
-                arrayIn[a, b] = 127
-    pilImg = Image.fromarray(arrayIn)
-    pilImg = pilImg.rotate(angle)
-
-    arrayIn = numpy.array(pilImg)
-    for a in range(0, arrayIn.shape[0]):
-        for b in range(0, arrayIn.shape[1]):
-            if (arrayIn[a, b] == 0):
-                arrayIn[a, b] = 255
-            if (arrayIn[a, b] == 127):
-                arrayIn[a, b] = 0
-
-    rotPart = Facsimile(arrayIn, facsName, facsIn.getOffset())
-    #rotPart.save()
-    return rotPart
+    return rotateImages([facsIn], angle, [facsName])[0]
+
+
+def rotateImages(facsList, angle, facsNames):
+    """
+    Rotates aligned images (e.g. a masked page and the page itself) counter-clockwise around their centre by the
+    desired angle, with one shared transform. The pixels are resampled with nearest neighbour, so binarised images
+    stay binary; the area rotated in from outside is filled with white.
+
+    Every rotated facsimile records the transform (see getRotationTransform()), so that its coordinates can be mapped
+    back to the unrotated image with mapToSource().
+    :param facsList: facsimiles of the same size
+    :param angle: in degrees
+    :param facsNames: names for the rotated facsimiles
+    :return: a list of the rotated facsimiles
+    """
+    (h, w) = facsList[0].image.shape[0:2]
+    transform = getRotationTransform(w, h, angle)
+
+    rotated = []
+    for n in range(0, len(facsList)):
+        pilImg = Image.fromarray(facsList[n].image)
+        fill = 255 if pilImg.mode == 'L' else (255,)*len(pilImg.getbands())
+        pilImg = pilImg.transform((w, h), Image.AFFINE, transform, Image.NEAREST, fillcolor=fill)
+
+        rotPart = Facsimile(numpy.array(pilImg), facsNames[n], facsList[n].getOffset())
+        rotPart.setTransform(transform)
+        rotated.append(rotPart)
+
+    return rotated
+
+
+def getRotationTransform(width, height, angle):
+    """
+    Returns the affine transform (a, b, c, d, e, f) of a counter-clockwise rotation by angle (degrees) around the
+    centre of an image, as PIL's Image.rotate() makes it: the pixel (x, y) = (j, i) of the rotated image is taken
+    from (a*x + b*y + c, d*x + e*y + f) of the unrotated one.
+    """
+    radians = -math.radians(angle % 360.0)
+    (cx, cy) = (width / 2.0, height / 2.0)
+    a = round(math.cos(radians), 15)
+    b = round(math.sin(radians), 15)
+    d = round(-math.sin(radians), 15)
+    e = round(math.cos(radians), 15)
+    return (a, b, a*(-cx) + b*(-cy) + cx, d, e, d*(-cx) + e*(-cy) + cy)
+
+
+def mapToSource(facsIn, i, j):
+    """
+    Maps coordinates (scalars or arrays) of a rotated facsimile to the image it was rotated from. Pixel (i, j) spans
+    [i, i+1) x [j, j+1); e.g. (i+0.5, j+0.5) maps to the point its value was sampled from.
+    :return: (i, j) as floats
+    """
+    (a, b, c, d, e, f) = facsIn.getTransform()
+    return (d*j + e*i + f, a*j + b*i + c)
 
 
 def findDateLine(facsIn, facsName):
@@ -845,16 +1577,13 @@ def findDateLine(facsIn, facsName):
     :return:
     """
     # Let's get top 20% of the masked page
-    pilImg = Image.fromarray(facsIn.getImage())
-    cropBox = (0, 0, facsIn.getImage().shape[1], int(facsIn.getImage().shape[0] * 0.20))
-    croppedRegion = pilImg.crop(cropBox)
-    topArea = numpy.array(croppedRegion)
-    topPart = Facsimile(topArea, 'dateLineDetectionArea', (0, 0))
+    topRegion = (0, int(facsIn.image.shape[0] * 0.20), 0, facsIn.image.shape[1])
     if Levers.debugFlag:
+        topPart = facsIn.getRegion(topRegion[0], topRegion[1], 0, topRegion[3], 'dateLineDetectionArea', (0, 0))
         topPart.save()
 
-    # Let's generate a projection profile for the masked image.
-    (normHorList, normVerList, maskedPageProj) = getProjections(topPart, 'dateLineDetectionAreaProj', Levers.debugFlag)
+    # Let's generate a projection profile for the top area of the masked image (from the page's summed-area table).
+    (normHorList, normVerList, maskedPageProj) = getProjections(facsIn, 'dateLineDetectionAreaProj', Levers.debugFlag, topRegion)
 
     # Let's find the first peak, and cut-off points before and after it.
     ind = findFirstPeak(normHorList, 10)
@@ -941,46 +1670,51 @@ def findDateLine(facsIn, facsName):
 
     medianWidth = widthTemp[ int(len(widthTemp)/2) ]
     # TODO: always when medianWidth/Height are used, there should be a maximum value set for them as a constraint.
-    merge = True
-
-    while (merge and len(tentativeList) > 1):
-        merge = False
-
-        # Let's connect dateline CC:s less than a medianWidth away from each other, if one is small and smaller.
-        for i in range(len(tentativeList)-1, -1, -1):
-            loppu = False
-            for j in range(len(tentativeList)-1, -1, -1):
-                if (i != j):
-
-                    if (calculateCCDistance2(tentativeList[i], tentativeList[j]) <= (medianWidth)):
-
-                        pcount1 = tentativeList[i].getPixelCount()
-                        pcount2 = tentativeList[j].getPixelCount()
-
-                        if (pcount1 < (pcount2/2) or pcount2 < (pcount1/2)):
-                            if (pcount1 < 150 or pcount2 < 150):
-                                #print ("merging")
-                                cc1 = tentativeList[i]
-                                cc2 = tentativeList[j]
-                                pl1 = tentativeList[i].getPixelList()
-                                pl2 = tentativeList[j].getPixelList()
-                                newlist = []
-
-                                for z in range(0, len(pl1)):
-                                    newlist.append(pl1[z])
-                                for z in range(0, len(pl2)):
-                                    newlist.append(pl2[z])
-
-                                mrg = ConnectedComponent(newlist)
-
-                                tentativeList.remove(cc1)
-                                tentativeList.remove(cc2)
-                                tentativeList.append(mrg)
-                                loppu = True
-                                merge = True
-                                break
-            if (loppu):
-                break
+    # The CCs are merged as disjoint sets, indexed by their bounding boxes so that only the near-by ones are
+    # measured; the order of the list is the order of the index's keys (a merged set gets a new, last key).
+    merger = ComponentMerger(tentativeList)
+    index = ComponentIndex()
+    for n in range(0, len(tentativeList)):
+        index.insert(n, merger.getMinMax(n))
+
+    # Let's connect dateline CC:s less than a medianWidth away from each other, if one is small and smaller.
+    # The CCs are examined from the end of the list. A merged CC is examined next; as the merging rule is symmetric,
+    # this gives the same merges as restarting the scan after every merge would.
+    keys = index.getKeys()
+    n = len(keys)-1
+    current = keys[n] if n >= 0 else None
+
+    while current is not None:
+        merged = None
+        set1 = index.getItem(current)
+        for other in reversed(index.queryBoxDistance(index.getMinMax(current), medianWidth+1)):
+            if (other != current):
+                set2 = index.getItem(other)
+
+                if (merger.getDistance(set1, set2, medianWidth) <= (medianWidth)):
+
+                    pcount1 = merger.getPixelCount(set1)
+                    pcount2 = merger.getPixelCount(set2)
+
+                    if (pcount1 < (pcount2/2) or pcount2 < (pcount1/2)):
+                        if (pcount1 < 150 or pcount2 < 150):
+                            #print ("merging")
+                            root = merger.union(set1, set2)
+                            index.remove(current)
+                            index.remove(other)
+                            merged = index.insert(root, merger.getMinMax(root))
+                            break
+
+        if merged is not None:
+            current = merged
+            continue
+
+        n -= 1
+        while n >= 0 and keys[n] not in index.items:
+            n -= 1
+        current = keys[n] if n >= 0 else None
+
+    tentativeList = [merger.getComponent(index.getItem(key)) for key in index.getKeys()]
 
     # Filter insubstantial CC after the above merging; less than 150pix overall;
     # Note: this could be the threshold for the look-up of CCs, but this allows fragments to be merged.
@@ -990,6 +1724,7 @@ def findDateLine(facsIn, facsName):
             continue
 
     # Filter small loner-CCs that aren't supported by a close CC
+    index = ComponentIndex(tentativeList)
     for y in range(len(tentativeList)-1, -1, -1):
         supported=False
 
@@ -998,20 +1733,19 @@ def findDateLine(facsIn, facsName):
         if (imax-imin) > 25:
             continue
 
-        for z in range(len(tentativeList)-1, -1, -1):
+        for z in index.queryDistance(tentativeList[y], medianWidth*3+1):
             if (y != z):
-                if (calculateCCDistance2(tentativeList[y], tentativeList[z]) <= (medianWidth*3)):
+                if (calculateCCDistance2(tentativeList[y], index.getItem(z), medianWidth*3) <= (medianWidth*3)):
                     supported=True
                     break
         if supported == False:
-            tentativeList.remove(tentativeList[y])
+            index.remove(y)
 
-    cropBox2 = (0, lineMin-1, facsIn.getImage().shape[1], lineMax+1)
-    croppedRegion2 = pilImg.crop(cropBox2)
+    tentativeList = [index.getItem(key) for key in index.getKeys()]
 
     mOffset = facsIn.getOffset()
 
-    dateLine = Facsimile(numpy.array(croppedRegion2), facsName, (mOffset[0] + lineMin, mOffset[1]))
+    dateLine = facsIn.getRegion(lineMin-1, lineMax+1, 0, facsIn.getShape()[1], facsName, (mOffset[0] + lineMin, mOffset[1]))
 
     if Levers.debugFlag==True:
         dateLine.save()
@@ -1025,26 +1759,21 @@ def getRGBArray(baseFacs):
     :param baseFacs:
     :return:
     """
-    imgArray = numpy.array(Image.new("RGB", (baseFacs.shape[1], baseFacs.shape[0]), "white"))
-    baseFacsImg = baseFacs
+    imgArray = numpy.empty((baseFacs.shape[0], baseFacs.shape[1], 3), dtype=numpy.uint8)
 
-    # Pasting in existing contents from baseFacs
-    for i in range(0, imgArray.shape[0]):
-        for j in range(0, imgArray.shape[1]):
-            val = baseFacsImg[i, j]
-            if (isinstance(val, int)):
-                val = [val, val, val]
-            imgArray[i, j] = val
+    # Pasting in existing contents from baseFacs (a greyscale value goes to all three channels).
+    if baseFacs.ndim == 2:
+        imgArray[...] = baseFacs[:, :, None]
+    else:
+        imgArray[...] = baseFacs
     return imgArray
 
 
 def renderFacsCC(baseFacs, cc, facsName, offset, colourIn='default'):
     """
-    A helper function to render CCs on top of the facsimile.
+    A helper function to render CCs on top of the facsimile. The rendering is deferred (see RenderedFacsimile).
     """
-    imgArray = getRGBArray(baseFacs.getImage())
-    imgArray = renderArrayCC(imgArray, cc, offset, colourIn)
-    ret = Facsimile(imgArray, facsName, baseFacs.getOffset())
+    ret = RenderedFacsimile(baseFacs, [(renderArrayCC, (cc, offset, colourIn))], facsName, baseFacs.getOffset())
     if Levers.debugFlag:
         ret.save()
     return ret
@@ -1054,27 +1783,24 @@ def renderArrayCC(imgArray, cc, offset, colourIn='default'):
     """
     A helper function to render an array of CCs on top of the image array.
     """
-    pixlist = cc.getPixelList()
-    for p in range(0, len(pixlist)):
-        (i, j) = pixlist[p]
-        if (colourIn == 'default'):
-            colour = [255, 0, 0]
-        else:
-            colour = colourIn
-        imgArray[i + offset[0], j + offset[1]] = colour
+    if (colourIn == 'default'):
+        colour = [255, 0, 0]
+    else:
+        colour = colourIn
+
+    ii, jj = cc.getPixels()
+    imgArray[ii + offset[0], jj + offset[1]] = colour
 
     return imgArray
 
 
 def renderFacsCCList(baseFacs, cclist, facsName, offset, colourIn='default'):
     """
-    A helper function to render a list of CCs on top of the facsimile.
+    A helper function to render a list of CCs on top of the facsimile. The rendering is deferred (see
+    RenderedFacsimile).
     """
-    imgArray = getRGBArray(baseFacs.getImage())
-
-    for i in range(0, len(cclist)):
-        imgArray = renderArrayCC(imgArray, cclist[i], offset, colourIn)
-    ret = Facsimile(imgArray, facsName, baseFacs.getOffset())
+    operations = [(renderArrayCCList, (list(cclist), offset, colourIn))]
+    ret = RenderedFacsimile(baseFacs, operations, facsName, baseFacs.getOffset())
     if Levers.debugFlag:
         ret.save()
     return ret
@@ -1091,9 +1817,10 @@ def renderArrayCCList(imgArray, cclist, offset, colourIn='default'):
 
 def renderFacsCCClusters(baseFacs, clusters, facsName, offset, colourIn='default'):
     """
-    A helper function to render CC clusters on top of the facsimile with a rotating colour.
+    A helper function to render CC clusters on top of the facsimile with a rotating colour. The rendering is deferred
+    (see RenderedFacsimile).
     """
-    imgArray = getRGBArray(baseFacs.getImage())
+    operations = []
 
     for k in range(0, len(clusters)):
         if (colourIn == 'default'):
@@ -1106,9 +1833,9 @@ def renderFacsCCClusters(baseFacs, clusters, facsName, offset, colourIn='default
         else:
             colour = colourIn
 
-        imgArray = renderArrayCCList(imgArray, clusters[k], offset, colour)
+        operations.append((renderArrayCCList, (list(clusters[k]), offset, colour)))
 
-    ret = Facsimile(imgArray, facsName, baseFacs.getOffset())
+    ret = RenderedFacsimile(baseFacs, operations, facsName, baseFacs.getOffset())
     if Levers.debugFlag:
         ret.save()
 
@@ -1223,7 +1950,7 @@ def spliceDividerArea(facsIn, dateLineIn, middleCluster):
     divider, let's splice the page image according to dateline's middle component.
     """
     # Find the area specified by the dateline component.
-    leftMost = facsIn.getImage().shape[1]
+    leftMost = facsIn.getShape()[1]
     rightMost = 0
     bottomMost = 0
 
@@ -1237,15 +1964,13 @@ def spliceDividerArea(facsIn, dateLineIn, middleCluster):
                 rightMost = jmax
 
     # Bottom most from the whole dateline, not only the centre cluster.
-    bottomMost = dateLineIn.getOffset()[0]+dateLineIn.getImage().shape[0]-facsIn.getOffset()[0]
+    bottomMost = dateLineIn.getOffset()[0]+dateLineIn.getShape()[0]-facsIn.getOffset()[0]
 
-    spliceImage = Image.fromarray(facsIn.getImage())
-    splicer = (leftMost, bottomMost+1, rightMost, facsIn.getImage().shape[0])
-    splice = spliceImage.crop(splicer)
     #fu.nbimage(array(splice))
     dlOffset = dateLineIn.getOffset()
 
-    columnDividerSplice = Facsimile(numpy.array(splice), 'columnDividerSplice', (facsIn.getOffset()[0]+bottomMost+1, facsIn.getOffset()[1]+leftMost))
+    columnDividerSplice = facsIn.getRegion(bottomMost+1, facsIn.getShape()[0], leftMost, rightMost, 'columnDividerSplice',
+                                           (facsIn.getOffset()[0]+bottomMost+1, facsIn.getOffset()[1]+leftMost))
     if Levers.debugFlag:
         columnDividerSplice.save()
 
@@ -1258,9 +1983,9 @@ def getCentreCluster(facsIn, clusters):
 
     """
 
-    centrePoint = int(facsIn.getImage().shape[1]/2)  #horizontal centre point
+    centrePoint = int(facsIn.getShape()[1]/2)  #horizontal centre point
 
-    tempDistance = facsIn.getImage().shape[1]
+    tempDistance = facsIn.getShape()[1]
     tempIndex = 0
     for i in range(0, len(clusters)):
         cclist = clusters[i]
@@ -1276,21 +2001,18 @@ def getCentreCluster(facsIn, clusters):
     return clusters[tempIndex]
 
 
-def applyVerticalMask(facsIn, facsName):
+def applyVerticalMask(facsIn, facsName, region=None):
     """
     Applies a vertical bloating mask to enhance the signal, because e.g. rotation of a binarised image can break lines.
-    See applyMask() for horizontal; @remove redundant code.
+    See applyMask() for horizontal (and for region); the vertical mask is the horizontal one run through the
+    transposed image.
     """
 
     img = facsIn.getImage()
+    area = img if region is None else img[region[0]:region[1], region[2]:region[3]]
 
-    # Let's run the mask through the image. The central pixel is changed only if both left and right regions contain ink.
-
-    for i in range(0, img.shape[0]):
-        for j in range(0, img.shape[1]):
-            if (img[i,j] == 255):
-                if (searchVerticalBlack(img,i-4, j-1) and searchVerticalBlack(img, i+1, j-1)):
-                    img[i,j] = 0
+    # The central pixel is changed only if both upper and lower regions (4x3 px) contain ink.
+    calculateMask(area.T)
 
     maskedPage = Facsimile(img, facsName, facsIn.getOffset())
     if Levers.debugFlag:
@@ -1299,18 +2021,12 @@ def applyVerticalMask(facsIn, facsName):
     return maskedPage
 
 
-def searchVerticalBlack(img, iin,j):
+def isVerticalOverlap(imin1, imax1, imin2, imax2):
     """
-    Searches for a region for black pixels. If found, returns True; else False.
-    @remove redundant code.
+    The divider merge's overlap test of the rows [imin1, imax1] against [imin2, imax2]. Note: not symmetric (e.g.
+    [5, 5] against [5, 10] is not an overlap, but [5, 10] against [5, 5] is); findDividingLine() tests both ways.
     """
-    for j in range(j, j+3):
-        i = iin
-        for i in range(i, i+4):
-            if (j >= 0 and j < img.shape[1] and i >= 0 and i < img.shape[0]):
-                if (img[i,j] == 0):
-                    return True
-    return False
+    return (imin1 > imin2 and imin1 < imax2) or (imax1 > imin2 and imax1 < imax2) or (imin1 <= imin2 and imax1 >= imax2)
 
 
 def findDividingLine(columnDividerSplice):
@@ -1358,108 +2074,87 @@ def findDividingLine(columnDividerSplice):
     # Get the longest CC; merge others to it if they share direction. Or, that is, if they are in less than n px away from each other.
     # Actually, the direction is the same because of the lengthwise test. Here, just test the proximity.
 
-    # merge others to the longest CC if they are close by
-    merge = True
-
-    while (merge and len(ccList) > 1):
-
-        merge = False
-        #print "Starting again. Length: ", len(ccList2)
-        for i in range(len(ccList)-1, -1, -1):
-            loppu = False
-            #print "i",i
-            for j in range(len(ccList)-1, -1, -1):
-                #print "j",j
-                if (ccList[i] != ccList[j]):
-                    if (calculateEndpointDistance(ccList[i], ccList[j]) < 35): #30 to 35, Dec 9th;
-                        # TODO: calculate distance from vertical endpoints only.
-                        # no vertical overlap allowed
-                        imin1,imax1,jmin1,jmax1 = ccList[i].getMinMax()
-                        imin2,imax2,jmin2,jmax2 = ccList[j].getMinMax()
-
-                        if (imin1 > imin2 and imin1 < imax2) or (imax1 > imin2 and imax1 < imax2) or (imin1 <= imin2 and imax1 >= imax2):
-                            #overlap
-                            #print ("overlap")
-                            pass
-                        else:
-                            #print "merging"
-
-                            cc1 = ccList[i]
-                            cc2 = ccList[j]
-                            pl1 = ccList[i].getPixelList()
-                            pl2 = ccList[j].getPixelList()
-
-                            for z in range(0, len(pl2)):
-                                pl1.append(pl2[z])
-
-                            mrg = ConnectedComponent(pl1)
-                            mrg.calculateMinMax()
-                            ccList.remove(cc1)
-                            ccList.remove(cc2)
-                            ccList.append(mrg)
-                            loppu = True
-                            merge = True
-                            break
-            if (loppu):
-                break
+    # merge others to the longest CC if they are close by (as disjoint sets; see findDateLine())
+    merger = ComponentMerger(ccList)
+    index = ComponentIndex()
+    for n in range(0, len(ccList)):
+        index.insert(n, merger.getMinMax(n))
+
+    keys = index.getKeys()
+    n = len(keys)-1
+    current = keys[n] if n >= 0 else None
+
+    while current is not None:
+        merged = None
+        set1 = index.getItem(current)
+        for other in reversed(index.queryBoxDistance(index.getMinMax(current), 35)):
+            if (other != current):
+                set2 = index.getItem(other)
+                if (calculateEndpointDistance(merger.getComponent(set1), merger.getComponent(set2)) < 35): #30 to 35, Dec 9th;
+                    # TODO: calculate distance from vertical endpoints only.
+                    # no vertical overlap allowed
+                    imin1,imax1,jmin1,jmax1 = merger.getMinMax(set1)
+                    imin2,imax2,jmin2,jmax2 = merger.getMinMax(set2)
+
+                    if isVerticalOverlap(imin1, imax1, imin2, imax2) or isVerticalOverlap(imin2, imax2, imin1, imax1):
+                        #overlap
+                        #print ("overlap")
+                        pass
+                    else:
+                        #print "merging"
+                        root = merger.union(set1, set2)
+                        index.remove(current)
+                        index.remove(other)
+                        merged = index.insert(root, merger.getMinMax(root))
+                        break
 
-    #get the longest CC
+        if merged is not None:
+            current = merged
+            continue
+
+        n -= 1
+        while n >= 0 and keys[n] not in index.items:
+            n -= 1
+        current = keys[n] if n >= 0 else None
+
+    setList = [index.getItem(key) for key in index.getKeys()]
+
+    #get the longest CC; only its pixels are materialised
     longIndex = -1
     length = -1
-    for y in range(0, len(ccList)):
-        cc = ccList[y]
-        (imin, imax, jmin, jmax) = cc.getMinMax()
+    for y in range(0, len(setList)):
+        (imin, imax, jmin, jmax) = merger.getMinMax(setList[y])
         l = imax-imin
         if (l > length):
             length = l
             longIndex = y
 
     dividerCC = None
-    if (longIndex >= 0 and longIndex < len(ccList)):
-        dividerCC = ccList[longIndex]
+    if (longIndex >= 0 and longIndex < len(setList)):
+        dividerCC = merger.getComponent(setList[longIndex])
 
     return dividerCC
 
 
 def getCCEndpoints(ccIn, dir='vertical'):
     """
-    Gets and returns the furthestmost endpoints of CCs.
+    Gets and returns the furthestmost endpoints of CCs as an (n, 2) array: the border pixels on the top-most row,
+    followed by those on the bottom-most row (none if the CC is a single row). The result does not depend on the
+    order of the pixel list.
     """
-
-    minCoords = []
-    maxCoords = []
-
     pixList = ccIn.getBorderPixels()
 
-    minPoint = 10000000
-    maxPoint = -10000000
-
-    for i in range(0, len(pixList)):
+    if dir != 'vertical' or len(pixList) == 0:
+        return pixList[:0]
 
-        if dir == 'vertical':
-            if pixList[i][0] < minPoint:
-                minPoint = pixList[i][0]
-                minCoords = []
-                minCoords.append(pixList[i])
-                continue
-            if pixList[i][0] == minPoint:
-                minCoords.append(pixList[i])
-                continue
-            if pixList[i][0] > maxPoint:
-                maxCoords = []
-                maxCoords.append(pixList[i])
-                continue
-            if pixList[i][0] == maxPoint:
-                maxCoords.append(pixList[i])
-                continue
-
-    coords = []
-    for i in range(0, len(minCoords)):
-        coords.append(minCoords[i])
-    for i in range(0, len(maxCoords)):
-        coords.append(maxCoords[i])
+    rows = pixList[:, 0]
+    minCoords = pixList[rows == rows.min()]
+    if rows.max() > rows.min():
+        maxCoords = pixList[rows == rows.max()]
+    else:
+        maxCoords = pixList[:0]
 
-    return coords
+    return numpy.concatenate((minCoords, maxCoords))
 
 
 def calculateEndpointDistance(p1, p2):
@@ -1469,17 +2164,13 @@ def calculateEndpointDistance(p1, p2):
     pixels1 = getCCEndpoints(p1)
     pixels2 = getCCEndpoints(p2)
 
-    minDist = 10000000
+    if len(pixels1) == 0 or len(pixels2) == 0:
+        return 10000000
 
-    for x in range(0, len(pixels1)):
-        for y in range(0, len(pixels2)):
-            c11, c12 = pixels1[x]
-            c21, c22 = pixels2[y]
-            dist = int(round(math.sqrt(math.pow((c11 - c21), 2) + math.pow((c12 - c22), 2))))
-            if (minDist > dist):
-                minDist = dist
+    diff = pixels1[:, None, :].astype(numpy.int64) - pixels2[None, :, :]
+    minDist = math.sqrt((diff**2).sum(axis=2).min())
 
-    return minDist
+    return int(round(minDist))
 
 
 def extractColumns(pageIn, columnDividerSplice, dividerCC, columnMin, columnMax, unmaskedPage):
@@ -1528,12 +2219,11 @@ def extractColumns(pageIn, columnDividerSplice, dividerCC, columnMin, columnMax,
             copyUnmaskedRight[i][j+offsetJ] = 255
 
     # clear divider
-    for i in range(0, len(dividerCC.getPixelList())):
-        a,b = dividerCC.getPixelList()[i]
-        copyLeft[a+offsetI][b+offsetJ] = 255
-        copyRight[a+offsetI][b+offsetJ] = 255
-        copyUnmaskedLeft[a+offsetI][b+offsetJ] = 255
-        copyUnmaskedRight[a+offsetI][b+offsetJ] = 255
+    ii, jj = dividerCC.getPixels()
+    copyLeft[ii+offsetI, jj+offsetJ] = 255
+    copyRight[ii+offsetI, jj+offsetJ] = 255
+    copyUnmaskedLeft[ii+offsetI, jj+offsetJ] = 255
+    copyUnmaskedRight[ii+offsetI, jj+offsetJ] = 255
 
     if columnMin != -1:
         topCutoff = columnMin-pageIn.getOffset()[0]
@@ -1545,24 +2235,19 @@ def extractColumns(pageIn, columnDividerSplice, dividerCC, columnMin, columnMax,
 
     # Let's define the regions for the two columns according to the cutoff points, and crop the page images accordingly.
 
-    baseLeft = Image.fromarray(copyLeft)
-    baseRight = Image.fromarray(copyRight)
+    # (The column images are views of the cleared copies.)
     if columnMax != -1:
         bottomCutoff = columnMax - pageIn.getOffset()[0]
-        col1Box = (0,topCutoff,divLeftCutoff, bottomCutoff)
-        col2Box = (divRightCutoff,topCutoff,copyRight.shape[1], bottomCutoff)
-
     else:
-        col1Box = (0,topCutoff,divLeftCutoff, copyLeft.shape[0])
-        col2Box = (divRightCutoff,topCutoff,copyRight.shape[1], copyRight.shape[0])
+        bottomCutoff = copyLeft.shape[0]
 
-    col1 = baseLeft.crop(col1Box)
-    col2 = baseRight.crop(col2Box)
+    col1 = cropArea(copyLeft, topCutoff, bottomCutoff, 0, divLeftCutoff)
+    col2 = cropArea(copyRight, topCutoff, bottomCutoff, divRightCutoff, copyRight.shape[1])
 
     mpOffset = pageIn.getOffset()
 
-    col1Img = Facsimile(numpy.array(col1), 'col1Img', (mpOffset[0]+topCutoff, mpOffset[1]))
-    col2Img = Facsimile(numpy.array(col2), 'col2Img', (mpOffset[0]+topCutoff, divRightCutoff+mpOffset[1]))
+    col1Img = Facsimile(col1, 'col1Img', (mpOffset[0]+topCutoff, mpOffset[1]))
+    col2Img = Facsimile(col2, 'col2Img', (mpOffset[0]+topCutoff, divRightCutoff+mpOffset[1]))
     if Levers.debugFlag:
         col1Img.save()
         col2Img.save()
@@ -1573,7 +2258,12 @@ def extractColumns(pageIn, columnDividerSplice, dividerCC, columnMin, columnMax,
     return [col1Img, col2Img], (copyUnmaskedLeftFacs, copyUnmaskedRightFacs)
 
 
-def findBorderMostConnectedComponents(binImg, direction, substantialLimit = 100, mode='default'):
+def findBorderMostConnectedComponents(binImg, direction, substantialLimit = 100, mode='default', labelling=None):
+    """
+    Finds the substantial connected components closest to the given border ('left', 'right' or 'bottom'); clears them
+    from binImg.
+    :param labelling: optionally, a ComponentLabelling to reuse; see findConnectedComponents()
+    """
 
     # Let's find all right-most, left-most and bottom-most _substantial_ connected components.
     # If there are problems, I could use a stronger bloating mask later.
@@ -1606,25 +2296,26 @@ def findBorderMostConnectedComponents(binImg, direction, substantialLimit = 100,
         end2 = int(binImg.shape[0]/2)
         step2 = -1
 
-    ccList = []
-    toCheck = set()
+    # Let's scan inward from the border along every step:th line; the first black pixel of each line is a seed.
+    outer = numpy.arange(start, end, step)
+    inner = numpy.arange(start2, end2, step2)
+    if (direction == 'right' or direction == 'left'):
+        scan = binImg[numpy.ix_(outer, inner)]
+    else:
+        scan = binImg[numpy.ix_(inner, outer)].T
 
-    verticalStopList = []
-    horizontalStopList = []
+    black = (scan == 0)
+    hits = numpy.nonzero(black.any(axis=1))[0]
+    firstBlack = black.argmax(axis=1)
 
-    for j in range(start, end, step):
-        for i in range(start2, end2, step2):
-            if (direction == 'right' or direction == 'left'):
-                if (binImg[j,i] == 0):
-                    toCheck.add((j,i))
-                    break
-            else:
-                if (binImg[i,j] == 0 ):
-                    toCheck.add((i,j))
-                    break
+    seeds = []
+    for n in hits:
+        if (direction == 'right' or direction == 'left'):
+            seeds.append((outer[n], inner[firstBlack[n]]))
+        else:
+            seeds.append((inner[firstBlack[n]], outer[n]))
 
-    while not len(toCheck) == 0:
-        ccList.append(findCC2(binImg, toCheck.pop()))
+    ccList = findSeededComponents(binImg, seeds, labelling)
 
     # Filter tiny CC; less than the limit (default 100pix) overall
     for y in range(len(ccList)-1,-1,-1):
@@ -1638,57 +2329,49 @@ def findBorderMostConnectedComponents(binImg, direction, substantialLimit = 100,
             if (imax-imin) < 14:
                 ccList.remove(ccList[y])
 
-    # Filter overlapping more inward CCs
-    filtered = True
-    while (filtered):
-        filtered=False
-        loppu = False
-
-        for i in range(len(ccList)-1, -1, -1):
-            for j in range(len(ccList)-1,-1,-1):
-                if (i != j):
-
-                    i_imin, i_imax, i_jmin, i_jmax = ccList[i].getMinMax()
-                    j_imin, j_imax, j_jmin, j_jmax = ccList[j].getMinMax()
-
-                    if (direction == "right"):
-                        for p in range(i_imin, i_imax):
-                            if (p >= j_imin and p <= j_imax):
-                                if (i_jmax > j_jmax):
-                                    ccList.remove(ccList[j])
-                                    loppu = True
-                                    filtered=True
-                                    break
-                    if (direction == "left"):
-                        for p in range(i_imin, i_imax):
-                            if (p >= j_imin and p <= j_imax):
-                                if (i_jmin < j_jmin):
-                                    if (mode=="initialCap"):
-                                        # only remove if they overlap substantially
-                                        i_height = i_imax - i_imin
-                                        j_height = j_imax - j_imin
-                                        if (abs(i_height-j_height) < 0.5*i_height):
-                                            ccList.remove(ccList[j])
-                                            loppu = True
-                                            filtered=True
-                                            break
-                                    else:
-                                        ccList.remove(ccList[j])
-                                        loppu = True
-                                        filtered=True
-                                        break
-                    if (direction == "bottom" and mode=="default"):
-                        for p in range(i_jmin, i_jmax):
-                            if (p >= j_jmin and p <= j_jmax):
-                                if (i_imax > j_imax):
-                                    ccList.remove(ccList[j])
-                                    loppu = True
-                                    filtered=True
-                                    break
-                if (loppu):
-                    break
-            if (loppu):
-                break
+    # Filter overlapping more inward CCs. The CCs are examined from the end of the list; each one removes, one at a
+    # time starting from the end of the list, the CCs it overlaps and is more outward than.
+    index = ComponentIndex(ccList)
+    keys = index.getKeys()
+
+    for k in range(len(keys)-1, -1, -1):
+        key = keys[k]
+        if key not in index.items:
+            continue  # already removed
+
+        i_imin, i_imax, i_jmin, i_jmax = index.getMinMax(key)
+
+        if (direction == "right" or direction == "left"):
+            candidates = index.queryRowBand(i_imin, i_imax-1)
+        elif (direction == "bottom" and mode=="default"):
+            candidates = index.queryColumnBand(i_jmin, i_jmax-1)
+        else:
+            candidates = []
+
+        for other in reversed(candidates):
+            if other == key:
+                continue
+
+            j_imin, j_imax, j_jmin, j_jmax = index.getMinMax(other)
+
+            if (direction == "right"):
+                if (i_jmax > j_jmax):
+                    index.remove(other)
+            if (direction == "left"):
+                if (i_jmin < j_jmin):
+                    if (mode=="initialCap"):
+                        # only remove if they overlap substantially
+                        i_height = i_imax - i_imin
+                        j_height = j_imax - j_imin
+                        if (abs(i_height-j_height) < 0.5*i_height):
+                            index.remove(other)
+                    else:
+                        index.remove(other)
+            if (direction == "bottom"):
+                if (i_imax > j_imax):
+                    index.remove(other)
+
+    ccList = [index.getItem(key) for key in index.getKeys()]
 
     return ccList
 
@@ -1756,16 +2439,11 @@ def removeCatchwords(facsIn):
     if redFlag == False:
         # remove the identified catchword CCs
         for i in range(0, len(bottomLine)):
-            pixList = bottomLine[i].getPixelList()
-            for j in range(0, len(pixList)):
-                a,b = pixList[j]
-                facsArea[a][b] = 255
+            ii, jj = bottomLine[i].getPixels()
+            facsArea[ii, jj] = 255
 
         # also, remove anything below
-        a,b = facsArea.shape
-        for i in range(bottomMostCoordinate, a):
-            for j in range(0, b):
-                facsArea[i][j] = 255
+        facsArea[bottomMostCoordinate:, :] = 255
 
     facsIn.setImage(facsArea)
     return facsIn
@@ -1773,7 +2451,6 @@ def removeCatchwords(facsIn):
 
 def removeExtraWhitespace(col1Img, colNbr, leftMostCC, rightMostCC, bottomMostCC):
 
-    tempArray = col1Img.getImage()
     # Limit the column so that all the bordering components, but no more are behind the limit. In order to find the cutoff point,
     # let's examine the CC: a cutoff point needs to be supported for it to be selected, i.e. it needs to have close neighbours.
     # This is to prevent a single blob detected as CC from determining the cutoff point.
@@ -1808,13 +2485,13 @@ def removeExtraWhitespace(col1Img, colNbr, leftMostCC, rightMostCC, bottomMostCC
             leftCutoff = leftValues[i]-1
             break
 
-    rightCutoff = col1Img.getImage().shape[1]
+    rightCutoff = col1Img.getShape()[1]
     for i in range(0, len(rightValues)-2):
         if (abs(rightValues[i] - rightValues[i+1]) <= 50 and abs(rightValues[i]-rightValues[i+2]) <= 50):
             rightCutoff = rightValues[i]+1
             break
 
-    bottomCutoff = col1Img.getImage().shape[0]
+    bottomCutoff = col1Img.getShape()[0]
 
     for i in range(0, len(bottomValues)-1):
 
@@ -1835,11 +2512,9 @@ def removeExtraWhitespace(col1Img, colNbr, leftMostCC, rightMostCC, bottomMostCC
             bottomCutoff = bottomValues[i]+1
             break
 
-    baseTmp = Image.fromarray(tempArray)
-    col1Box = (leftCutoff,0,rightCutoff, bottomCutoff)
-    col1 = baseTmp.crop(col1Box)
     mpOffset = col1Img.getOffset()
-    col1ImgCropped = Facsimile(numpy.array(col1), 'col1ImgCropped', (mpOffset[0], mpOffset[1]+leftCutoff))
+    col1ImgCropped = col1Img.getRegion(0, bottomCutoff, leftCutoff, rightCutoff, 'col1ImgCropped',
+                                       (mpOffset[0], mpOffset[1]+leftCutoff))
     if Levers.debugFlag:
         col1ImgCropped.save()
     return col1ImgCropped
@@ -1848,16 +2523,12 @@ def removeExtraWhitespace(col1Img, colNbr, leftMostCC, rightMostCC, bottomMostCC
 def unmaskFacsimile(baseFacs, maskedFacs, facsName):
     # Get the corresponding area from the 'binarised image' or from the 'rotated binarised page image'
 
-    baseOrig = Image.fromarray(baseFacs.getImage())
-
     (i1,j1) = baseFacs.getOffset()
     (i2,j2) = maskedFacs.getOffset()
     (i,j) = (i2-i1, j2-j1)
 
-    (a,b) = maskedFacs.getImage().shape
-    cropBox = (j, i, j+b, i+a)
-    unmasked = baseOrig.crop(cropBox)
-    maskedFacsUnmasked = Facsimile(numpy.array(unmasked), facsName, maskedFacs.getOffset())
+    (a,b) = maskedFacs.getShape()
+    maskedFacsUnmasked = baseFacs.getRegion(i, i+a, j, j+b, facsName, maskedFacs.getOffset())
     if Levers.debugFlag:
         maskedFacsUnmasked.save()
 
@@ -1867,21 +2538,16 @@ def unmaskFacsimile(baseFacs, maskedFacs, facsName):
 def drawRegionBorders(arrayIn, facsIn, colour, width):
 
     offset = facsIn.getOffset()
-    regionIn = facsIn.getImage().shape
-
-    for w in range(0,width):
+    regionIn = facsIn.getShape()
+    (i0, j0) = (offset[0], offset[1])
+    (i1, j1) = (offset[0]+regionIn[0], offset[1]+regionIn[1])
 
-        for x in range(0, regionIn[0]):
-            arrayIn[offset[0]+x, offset[1]+w] = colour
-
-        for y in range(0, regionIn[1]):
-            arrayIn[offset[0]+w, offset[1]+y] = colour
-
-        for x in range(0, regionIn[0]):
-            arrayIn[offset[0]+x, offset[1]+regionIn[1]-w] = colour
-
-        for y in range(0, regionIn[1]):
-            arrayIn[offset[0]+regionIn[0]-w, offset[1]+y] = colour
+    if width > 0:
+        # Left and top borders start at the region's edge; right and bottom borders end one pixel past it.
+        arrayIn[i0:i1, j0:j0+width] = colour
+        arrayIn[i0:i0+width, j0:j1] = colour
+        arrayIn[i0:i1, j1-width+1:j1+1] = colour
+        arrayIn[i1-width+1:i1+1, j0:j1] = colour
 
     arrayOut = arrayIn
     return arrayOut
@@ -1890,15 +2556,13 @@ def drawRegionBorders(arrayIn, facsIn, colour, width):
 def overlayRegion(baseIn, overlayFacs):
 
     offset = overlayFacs.getOffset()
-    overlay = overlayFacs.getImage()
+    overlay = overlayFacs.getView()
 
-    for i in range(0, overlay.shape[0]):
-        for j in range(0, overlay.shape[1]):
-
-            val = overlay[i,j]
-            if (isinstance(val,int)):
-                val = [val,val,val]
-            baseIn[i+offset[0],j+offset[1]] = val
+    region = baseIn[offset[0]:offset[0]+overlay.shape[0], offset[1]:offset[1]+overlay.shape[1]]
+    if overlay.ndim == 2 and baseIn.ndim == 3:
+        region[...] = overlay[:, :, None]
+    else:
+        region[...] = overlay
 
     return baseIn
 
@@ -1916,14 +2580,14 @@ def analyseDivider(dividerCC, baseFacs, dividerFacs):
     # CR: I could pass the heading area to Tesseract and save it into XML as <ab>...</ab>.
     columnMin = -1
     columnMax = -1
-    baseArea = baseFacs.getImage()
+    baseArea = baseFacs.getView()
 
     # Divider's min and max i coordinates:
     dividerMin,dividerMax,jmin,jmax = dividerCC.getMinMax()
 
     # The coordinate is relative to the columnDividerArea, which starts just under the dateline.
     # In normal cases, the divider starts very close to the column divider area's top.
-    if dividerMin < 500 and dividerFacs.getImage().shape[0]-dividerMax < 600:
+    if dividerMin < 500 and dividerFacs.getShape()[0]-dividerMax < 600:
         return (columnMin,columnMax)
 
     if dividerMin >= 500:
@@ -1938,9 +2602,7 @@ def analyseDivider(dividerCC, baseFacs, dividerFacs):
         # Calculate relative offset
         offsetI = dividerOffsetI - baseOffsetI
 
-        testImage = Image.fromarray(baseArea)
-        testAreaBox = (0,offsetI,baseArea.shape[1],dividerMin+50+offsetI)
-        testArea = numpy.array(testImage.crop(testAreaBox))
+        testArea = cropArea(baseArea, offsetI, dividerMin+50+offsetI, 0, baseArea.shape[1])
 
         testFacs = Facsimile(testArea, "testAreaTop")
         #fu.nbimage(testFacs.getImage())
@@ -1966,7 +2628,7 @@ def analyseDivider(dividerCC, baseFacs, dividerFacs):
                 # Changing the divider offset; this will be used in the next processing stage to cut the columns accordingly.
                 columnMin = dividerFacs.getOffset()[0]+botI-1
 
-    if dividerFacs.getImage().shape[0]-dividerMax >= 600:
+    if dividerFacs.getShape()[0]-dividerMax >= 600:
         #print ("According to analysis of the divider, the page is possibly the starting page of the body of resolutions.")
 
         # Let's check if there's a vertical white space across the image.
@@ -1977,9 +2639,7 @@ def analyseDivider(dividerCC, baseFacs, dividerFacs):
         # Calculate relative offset
         offsetI = dividerOffsetI - baseOffsetI
 
-        testImage = Image.fromarray(baseArea)
-        testAreaBoxTop = (0, dividerMax-50+offsetI, baseArea.shape[1], baseArea.shape[0])
-        testAreaTop = numpy.array(testImage.crop(testAreaBoxTop))
+        testAreaTop = cropArea(baseArea, dividerMax-50+offsetI, baseArea.shape[0], 0, baseArea.shape[1])
         testFacs = Facsimile(testAreaTop, "testAreaTop")
         #fu.nbimage(testFacs.getImage())
 
@@ -13,6 +13,10 @@ import codecs
 import numpy as np
 from PIL import Image
 import Levers
+import HelperFunctions as fu
+import OCR as ocr
+import os
+from concurrent.futures import ThreadPoolExecutor
 #from DocumentImageAnalysis import *
 from subprocess import check_output
 
@@ -148,7 +152,9 @@ class PhysicalSection():
 
 
 def renderSections(baseFacs, sectionList, facsName, colourIn='default', offsetIn='default'):
-
+    """
+    Renders the sections' areas on top of the facsimile. The rendering is deferred (see dia.RenderedFacsimile).
+    """
     offset=[0,0]
     if offsetIn=='default':
         offset = [0,0]
@@ -156,33 +162,34 @@ def renderSections(baseFacs, sectionList, facsName, colourIn='default', offsetIn
         offset[0] = offsetIn[0]
         offset[1] = offsetIn[1]
 
-    imgArray = dia.getRGBArray(baseFacs.getImage())
-
-    for s in range(0, len(sectionList)):
-        sec = sectionList[s]
-        for i in range(sec.getStart()[0], sec.getEnd()[0]+1):
-            for j in range(sec.getStart()[1], sec.getEnd()[1]):
-                if (colourIn == 'default'):
-                    colour = [255, 0, 0]
-                else:
-                    colour = colourIn
-                imgArray[i+offset[0], j+offset[1]] = colour
-
-    ret = dia.Facsimile(imgArray, facsName, baseFacs.getOffset())
+    operations = [(renderArraySections, (list(sectionList), offset, colourIn))]
+    ret = dia.RenderedFacsimile(baseFacs, operations, facsName, baseFacs.getOffset())
     if Levers.debugFlag:
         ret.save()
     return ret
 
-def getImageArea(baseArea, iTop, jTop, iBottom, jBottom):
 
-    # Get the image to work with; PIL is used to create the image and to perform the crop.
-    tempImage = Image.fromarray(baseArea)
+def renderArraySections(imgArray, sectionList, offset, colourIn='default'):
+    """
+    Renders the sections' areas on top of the image array.
+    """
+    if (colourIn == 'default'):
+        colour = [255, 0, 0]
+    else:
+        colour = colourIn
+
+    for s in range(0, len(sectionList)):
+        sec = sectionList[s]
+        (iStart, jStart) = sec.getStart()
+        (iEnd, jEnd) = sec.getEnd()
+        if iEnd+1 > iStart and jEnd > jStart:
+            imgArray[iStart+offset[0]:iEnd+1+offset[0], jStart+offset[1]:jEnd+offset[1]] = colour
+
+    return imgArray
 
-    # Crop the image according to the region we specified by searching for the cutoff points.
-    box = (jTop, iTop, jBottom, iBottom)
-    croppedRegion = tempImage.crop(box)
+def getImageArea(baseArea, iTop, jTop, iBottom, jBottom):
 
-    return np.array(croppedRegion)
+    return dia.cropArea(baseArea, iTop, iBottom, jTop, jBottom)
 
 
 def analyseSections(sectionList):
@@ -241,20 +248,22 @@ def buildElementQueue(sectionList, pagei, colj, datelineText):
 def createInitialImage(initial):
 
     imin,imax,jmin,jmax = initial.getMinMax()
-    pixelList = initial.getInitialCC().getPixelList()
+    ii, jj = initial.getInitialCC().getPixels()
 
     im = Image.new("L", (jmax-jmin+1+2,imax-imin+1+2), "white")
 
     pixMap = np.array(im)
-    for x in range(0, len(pixelList)):
-        (i,j) = pixelList[x]
-        pixMap[i-imin+1][j-jmin+1] = 0
+    pixMap[ii-imin+1, jj-jmin+1] = 0
 
     return pixMap
 
 
-def ocrSections(sectionList):
-
+def prepareOCRJobs(sectionList):
+    """ Prepares the OCR splices of a column's sections.
+    :param sectionList:
+    :return: list of OCR jobs: (content setter, OCR type, section name, splice)
+    """
+    jobs = []
     for t in range(0, len(sectionList)):
         if (isinstance(sectionList[t], str)):
             continue
@@ -263,20 +272,20 @@ def ocrSections(sectionList):
             if sectionList[t].getInitialCapital() == None:
                 sectionArea = sectionList[t].getImageArea()
                 sectionName = "page"+str(sectionList[t].getPageI()) + "_col" + str(sectionList[t].getColJ())+"_section"+str(t)
-                saveTesseractImage(sectionArea, sectionName)
+                splice = prepareTesseractSplice(sectionArea, sectionName)
 
-                isStart = col.isStartingSection(-1,-1,sectionList[t].getLines(), sectionList[t].getImageArea().shape[1])
+                isStart = col.isStartingSection(-1,-1,sectionList[t].getLines(), sectionArea.shape[1])
                 if isStart == True:
-                    sectionList[t].setTextContent(Tesseract(sectionName, "head"))
+                    jobs.append((sectionList[t].setTextContent, "head", sectionName, splice))
                 else:
-                    sectionList[t].setTextContent(Tesseract(sectionName, "body"))
+                    jobs.append((sectionList[t].setTextContent, "body", sectionName, splice))
             else:
                 # There's an initial, let's OCR it separately.
                 sectionName = "page"+str(sectionList[t].getPageI()) + "_col" + str(sectionList[t].getColJ())+"_section"+str(t)
 
                 # create an image for the initial; save it as tif.
                 initialArray = createInitialImage(sectionList[t].getInitialCapital())
-                saveTesseractImage(initialArray, sectionName+"_i")
+                initialSplice = prepareTesseractSplice(initialArray, sectionName+"_i")
 
                 # remove the initial from the section's tif.
                 sectionOffset = sectionList[t].getInitialCapital().getSectionOffset()
@@ -287,52 +296,197 @@ def ocrSections(sectionList):
                     for j in range(jmin, jmax):
                         sectionArea[i-sectionOffset[0]][j] = 255
 
-                saveTesseractImage(sectionArea, sectionName)
-                sectionList[t].setTextContent(Tesseract(sectionName, "body"))
-                sectionList[t].setInitialTextContent(Tesseract(sectionName+"_i", "initial"))
+                splice = prepareTesseractSplice(sectionArea, sectionName)
+                jobs.append((sectionList[t].setTextContent, "body", sectionName, splice))
+                jobs.append((sectionList[t].setInitialTextContent, "initial", sectionName+"_i", initialSplice))
 
-    return sectionList
+    return jobs
 
 
-def saveTesseractImage(sectionArea, sectionName):
-    """ Saves the image area as TIF; the Tesseract binaries in use only accept TIFs.
+def runOCRJobs(jobs):
+    """ Recognises the OCR jobs (see prepareOCRJobs()) in one batch per OCR type and sets the recognised content.
+        If a batch fails, its splices are retried one by one, so that a single bad splice only empties its own
+        section.
+    :param jobs:
+    :return:
+    """
+    types = []
+    for job in jobs:
+        if job[1] not in types:
+            types.append(job[1])
+
+    for type in types:
+        typeJobs = [job for job in jobs if job[1] == type]
+        try:
+            texts = ocr.recogniseBatch([job[3] for job in typeJobs], type)
+        except Exception:
+            texts = []
+            for job in typeJobs:
+                try:
+                    texts.append(ocr.recogniseBatch([job[3]], type)[0])
+                except Exception:
+                    print("Failed to use Tesseract.")
+                    texts.append("")
+
+        for (setContent, type, sectionName, splice), text in zip(typeJobs, texts):
+            setContent(ocrTextToContent(text, type, sectionName))
+
+
+class OCRQueue():
+    """
+    OCRs pages in the background and writes their XML in document order.
+    submit() prepares a column's splices in the calling thread, so the saved files and debug numbering are as in
+    serial processing. endPage() hands the page's splices to a thread pool as one batch per OCR type (see
+    runOCRJobs()): Tesseract start-up and model loading are paid once per page and model, and the OCR (run in the OCR
+    workers or Tesseract processes) overlaps with the analysis of the next page. The batches are per page rather
+    than per spread because a spread's batch could only start once all of its pages were segmented, leaving nothing
+    to overlap with.
+    drain() ends the current page and waits for the submitted pages in submission order, running buildElementQueue()
+    and processQueue() for each column, so the document is the same as in serial processing. Anything else written
+    to the document (e.g. notes on skipped pages) must be preceded by drain().
+    With workers=0, endPage() OCRs and writes the page at once (serial processing).
+    """
+
+    def __init__(self, document, workers=0):
+        self.document = document
+        self.executor = None
+        if workers > 0:
+            self.executor = ThreadPoolExecutor(workers)
+        self.jobs = []
+        self.columns = []
+        self.pending = []
+
+    def submit(self, sectionList, pagei, colj, datelineText):
+        """
+        Adds a column's analysed sections (see analyseSections()) to the current page's OCR batch.
+        """
+        self.jobs.extend(prepareOCRJobs(sectionList))
+        self.columns.append((sectionList, pagei, colj, datelineText))
+
+    def endPage(self):
+        """
+        Submits the current page's OCR batch.
+        """
+        if len(self.columns) == 0:
+            return
+        (jobs, columns) = (self.jobs, self.columns)
+        self.jobs = []
+        self.columns = []
+        if self.executor is None:
+            runOCRJobs(jobs)
+            for column in columns:
+                self.write(*column)
+            return
+        self.pending.append((self.executor.submit(runOCRJobs, jobs), columns))
+
+    def drain(self):
+        """
+        Waits for the submitted pages and writes their columns to the document, in submission order. If writing a
+        column fails, the columns after it are dropped (as serial processing would have stopped there) and the error
+        is raised.
+        """
+        self.endPage()
+        while len(self.pending) > 0:
+            (future, columns) = self.pending.pop(0)
+            try:
+                future.result()
+                for column in columns:
+                    self.write(*column)
+            except Exception:
+                self.pending = []
+                raise
+
+    def write(self, sectionList, pagei, colj, datelineText):
+        elementQueue = buildElementQueue(sectionList, pagei, colj, datelineText)
+        processQueue(elementQueue, pagei, colj, self.document)
+
+    def close(self):
+        self.drain()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def prepareTesseractSplice(sectionArea, sectionName):
+    """ Prepares the image area for OCR (filters fragments and pads it) and returns it for Tesseract().
+        The splice is saved as TIF only without the OCR pool or with Levers.keepOCRFiles.
     :param sectionArea:
     :param sectionName:
-    :return:
+    :return: the splice array
     """
     sectionArea = filterFragments(sectionArea)
     sectionArea = padTesseractSplice(sectionArea, 20)
-    tmpSectionFacs = dia.Facsimile(sectionArea, "tmpSectionFacs")
-    tmpSectionFacs.save(sectionName+"_tes", "default", "TIFF")
+    if Levers.keepOCRFiles or not Levers.useOCRPool:
+        tmpSectionFacs = dia.Facsimile(sectionArea, "tmpSectionFacs")
+        tmpSectionFacs.save(sectionName+"_tes", "default", "TIFF", True)
+    return sectionArea
 
 
-def Tesseract(sectionName, type='default'):
+def Tesseract(sectionName, type='default', splice=None):
     """ Runs Tesseract on the input image splice.
+        Given the splice array (see prepareTesseractSplice()), or with Levers.useOCRPool, the result is looked up in
+        the OCR cache and otherwise recognised by the long-lived OCR workers (see OCR.OCRPool) or a Tesseract run (see
+        OCR.recognise()). Otherwise, the Tesseract command is run for the saved splice.
     """
     recognisedContent = []
 
-    if type=="default" or "body":
-        tesseractConfig="-l custom_body_v2_1740_2+emop_body_v2_1740_2 -psm 6 bodyConfig.txt"
-    if type=="dateline":
-        tesseractConfig="-l custom_dateline_v1 -psm 4 datelineConfig.txt"
-    if type=="head":
-        tesseractConfig="-l custom_head_v2_1740_2 -psm 6 headConfig.txt"
-    if type=="initial":
-        tesseractConfig="-l custom_body_v2_1740_2+emop_body_v2_1740_2 -psm 10"
+    tesseractConfig = ocr.getTesseractArguments(type)
 
     # Let's use Tesseract
-    command = "tesseract.exe "+Levers.dir_out+str(Levers.saveDir)+"/"+ sectionName+"_tes.tif " + Levers.dir_out+str(Levers.saveDir)+"/"+sectionName+"_tes " + tesseractConfig
+    command = Levers.tesseractCommand+" "+Levers.dir_out+str(Levers.saveDir)+"/"+ sectionName+"_tes.tif " + Levers.dir_out+str(Levers.saveDir)+"/"+sectionName+"_tes " + tesseractConfig
     #print ("command", command)
 
     try:
-        output = check_output(command)
-        #print(output)
-        recognisedContent = readTextFile(Levers.dir_out+str(Levers.saveDir)+"/" + sectionName +"_tes.txt")
+        if Levers.useOCRPool or splice is not None:
+            if splice is None:
+                with Image.open(Levers.dir_out+str(Levers.saveDir)+"/"+ sectionName+"_tes.tif") as img:
+                    splice = np.array(img)
+            text = ocr.recognise(splice, type)
+            return ocrTextToContent(text, type, sectionName)
+        else:
+            output = check_output(command)
+            #print(output)
+            recognisedContent = readTextFile(Levers.dir_out+str(Levers.saveDir)+"/" + sectionName +"_tes.txt")
 
     except Exception:
         print("Failed to use Tesseract.")
         #debug("["+fileList[f]+"]: " + "Failed to process the image.")
 
+    return finishOCRContent(recognisedContent, type, sectionName)
+
+
+def ocrTextToContent(text, type, sectionName):
+    """ Returns the content lines of text recognised in memory (see Tesseract()); the text file is written only
+        without the OCR pool (next to the splice's TIF) or with Levers.keepOCRFiles.
+    :param text:
+    :param type:
+    :param sectionName:
+    :return:
+    """
+    if Levers.keepOCRFiles or not Levers.useOCRPool:
+        outfile = codecs.open(Levers.dir_out+str(Levers.saveDir)+"/" + sectionName +"_tes.txt", "w", "utf-8")
+        outfile.write(text)
+        outfile.close()
+
+    return finishOCRContent(ocr.textToLines(text), type, sectionName)
+
+
+def finishOCRContent(recognisedContent, type, sectionName):
+    """ Post-processes the recognised content lines of a splice, and moves its intermediate files into the debug
+        bundle (if any).
+    :param recognisedContent:
+    :param type:
+    :param sectionName:
+    :return:
+    """
+    # With a debug bundle, the intermediate files are moved into it.
+    bundle = fu.getDebugBundle()
+    if bundle is not None:
+        for fileType in (".tif", ".txt"):
+            path = Levers.dir_out+str(Levers.saveDir)+"/" + sectionName + "_tes" + fileType
+            if os.path.exists(path):
+                bundle.addFile(sectionName + "_tes" + fileType, path, {'stage': 'ocr', 'type': type})
+
     # fix: Tesseract fails to read a TIF.
     if len(recognisedContent) == 0:
         recognisedContent.append(" ")
@@ -380,10 +534,8 @@ def filterFragments(imageArea):
 
     # Draws the remaining CCs back
     for l in range(0, len(ccList)):
-        pl = ccList[l].getPixelList()
-        for p in range(0, len(pl)):
-            i,j = pl[p]
-            cleanArea[i][j] = 0
+        ii, jj = ccList[l].getPixels()
+        cleanArea[ii, jj] = 0
 
     return cleanArea
 
@@ -404,6 +556,12 @@ def contextSensitiveFilterFragments(ccList, maxSize):
     substantial = 40
     remList = []
 
+    # Only the substantial CCs can give support; they're indexed by their bounding boxes.
+    substantialIndex = dia.ComponentIndex()
+    for j in range(0, len(ccList)):
+        if ccList[j].getPixelCount() >= substantial:
+            substantialIndex.insert(ccList[j])
+
     # Let's examine the small CCs, and for each of them, whether they have support or not.
     for i in range(0, len(ccList)):
         cc = ccList[i]
@@ -414,47 +572,22 @@ def contextSensitiveFilterFragments(ccList, maxSize):
 
         imin,imax,jmin,jmax = ccList[i].getMinMax()
 
+        # The support regions (inclusive): down, and left.
+        regions = [(imax+1, imax+down, jmin-2, jmax+1),
+                   (imin-2, imax+1, jmin-left, jmin)]
+
         found = False
-        for j in range(0, len(ccList)):
-            if (i == j):
-                continue
-
-            if ccList[j].getPixelCount() < substantial:
-                continue
-
-            pixelList = ccList[j].getPixelList()
-
-            # let's test support down
-            for k in range(jmin-2, jmax+2):
-                for l in range(imax+1, imax+1+down):
-                    for m in range(0, len(pixelList)):
-                        (a,b) = pixelList[m]
-                        if (a==l and b==k):
-                            found=True
-                            break
-                    if (found==True):
-                        break
-                if (found==True):
+        for (rimin, rimax, rjmin, rjmax) in regions:
+            for key in substantialIndex.queryBox(rimin, rimax, rjmin, rjmax):
+                if substantialIndex.getItem(key) is cc:
+                    continue
+                a, b = substantialIndex.getItem(key).getPixels()
+                if np.any((a >= rimin) & (a <= rimax) & (b >= rjmin) & (b <= rjmax)):
+                    found = True
                     break
             if (found==True):
                 break
 
-            if (found==False):
-                # let's test support left, if support down wasn't already found.
-                for k in range(jmin, jmin-1-left, -1):
-                    for l in range(imin-2, imax+2):
-                        for m in range(0, len(pixelList)):
-                            (a,b) = pixelList[m]
-                            if (a==l and b==k):
-                                found=True
-                                break
-                        if (found==True):
-                            break
-                    if (found==True):
-                        break
-                if (found==True):
-                    break
-
         if found == False:
             remList.append(ccList[i])
 
@@ -8,7 +8,17 @@
 
 from os import listdir
 from numpy import array
+import numpy
 import codecs
+import hashlib
+import io
+import os
+import time
+import threading
+import atexit
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
 from PIL import Image
 import Levers
 from time import strftime
@@ -127,11 +137,420 @@ def getFiles(dir_in, file_ext):
     return file_names
 
 
-def loadImage(dir_in, file_name):
+def hashFile(fileName, chunkSize=1 << 20):
     """
-    Loads an image and returns it as an array.
+    Returns the SHA-1 hex digest of a file's content.
     """
-    img = array(Image.open(dir_in + file_name))
+    sha = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        chunk = f.read(chunkSize)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(chunkSize)
+    return sha.hexdigest()
+
+
+class DiskCache():
+    """
+    A size-bounded on-disk cache of named numpy arrays, shared by processes working on the same directory.
+
+    An entry is a .npz file named by the SHA-1 of its key. Entries are written to a temporary file and renamed into
+    place, so a reader never sees a partial entry; an entry evicted while being read is simply a miss. A hit touches
+    the entry's modification time, and when the cache grows over maxBytes, the least recently used entries are
+    removed; one process at a time evicts (the others skip eviction while the lock file exists).
+
+    The directory is scanned only when needed: the size of the cache is estimated from the last scan and the entries
+    stored since, and the directory is scanned (and evicted if needed) when the estimate goes over maxBytes, or every
+    rescanEvery stores (to account for the entries stored by other processes).
+    """
+
+    def __init__(self, directory, maxBytes, rescanEvery=1000):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.rescanEvery = rescanEvery
+        self.estimatedBytes = None
+        self.storesSinceScan = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def makeKey(*parts):
+        """
+        Returns a key for the given parts (e.g. a content hash and a stage's parameters).
+        """
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        """
+        Returns the arrays stored for the key as a dict; None if there are none.
+        """
+        path = self.getPath(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except (FileNotFoundError, PermissionError):
+            return None
+
+        with numpy.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return dict(arrays)
+
+    def store(self, key, arrays):
+        """
+        Stores the named arrays (a dict) for the key; then evicts if the cache has grown too large.
+        """
+        path = self.getPath(key)
+        tempPath = path + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp'
+        with open(tempPath, 'wb') as f:
+            numpy.savez(f, **arrays)
+        size = os.path.getsize(tempPath)
+        os.replace(tempPath, path)
+
+        # Note: a replaced entry is counted twice; the estimate only errs on the large side.
+        with self.lock:
+            if self.estimatedBytes is not None:
+                self.estimatedBytes += size
+            self.storesSinceScan += 1
+            due = (self.estimatedBytes is None or self.estimatedBytes > self.maxBytes or
+                   self.storesSinceScan >= self.rescanEvery)
+        if due:
+            self.evict()
+
+    def evict(self, staleLock=600):
+        """
+        Removes the least recently used entries if the cache is over maxBytes, until it fits in 90% of maxBytes (so
+        that the next eviction is not due right away).
+        :param staleLock: seconds after which a left-over lock file (e.g. from a killed process) is ignored
+        """
+        lockPath = os.path.join(self.directory, 'evict.lock')
+        try:
+            lock = os.open(lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lockPath) < staleLock:
+                    return
+                os.remove(lockPath)
+            except OSError:
+                pass
+            return
+
+        try:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith('.npz'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total += stat.st_size
+
+            if total > self.maxBytes:
+                entries.sort()
+                for (mtime, size, name) in entries:
+                    if total <= self.maxBytes * 0.9:
+                        break
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+                    total -= size
+
+            with self.lock:
+                self.estimatedBytes = total
+                self.storesSinceScan = 0
+        finally:
+            os.close(lock)
+            os.remove(lockPath)
+
+
+class ImageWriter():
+    """
+    Encodes and writes images in background threads, so that saving debug images does not hold up the processing.
+
+    An image is copied when it is queued (later changes to the array do not affect what is written). At most
+    maxPending images wait to be written; when that many are pending, write() blocks until one is done
+    (backpressure, to bound the memory held by the snapshots). Errors are collected and reported by flush().
+    """
+
+    def __init__(self, workers=2, maxPending=16):
+        self.executor = ThreadPoolExecutor(workers)
+        self.slots = threading.BoundedSemaphore(maxPending)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.errors = []
+        self.directories = set()
+
+    def write(self, imageArea, fileName, fileType, bundle=None, entry=None):
+        """
+        Queues an image array to be written.
+        :param fileName: path of the file to write; or with a bundle, the name of the entry
+        :param fileType: PIL format name (e.g. "PNG", "TIFF")
+        :param bundle: if given, the image is added to this DebugBundle instead of written as a file
+        :param entry: manifest information for the bundle (see DebugBundle.addImage())
+        """
+        self.slots.acquire()
+        try:
+            snapshot = numpy.array(imageArea, copy=True)
+            future = self.executor.submit(self.writeImage, snapshot, fileName, fileType, bundle, entry)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.finish)
+
+    def writeImage(self, imageArea, fileName, fileType, bundle=None, entry=None):
+        try:
+            if bundle is not None:
+                bundle.addImage(fileName, imageArea, fileType, entry)
+                return
+            directory = os.path.dirname(fileName)
+            if directory not in self.directories:
+                os.makedirs(directory, exist_ok=True)
+                self.directories.add(directory)
+            Image.fromarray(imageArea).save(fileName, fileType)
+        except Exception as e:
+            raise IOError("Failed to write " + fileName + ": " + repr(e))
+        finally:
+            self.slots.release()
+
+    def finish(self, future):
+        with self.lock:
+            self.pending.discard(future)
+            if future.exception() is not None:
+                self.errors.append(str(future.exception()))
+
+    def flush(self):
+        """
+        Waits for the queued images to be written. Reports and returns the errors since the last flush.
+        :return: list of error messages
+        """
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+
+        with self.lock:
+            errors = self.errors
+            self.errors = []
+        for error in errors:
+            print("WARNING. " + error)
+        return errors
+
+    def close(self):
+        errors = self.flush()
+        self.executor.shutdown()
+        return errors
+
+
+imageWriter = None
+
+
+def getImageWriter():
+    """
+    Returns the shared background image writer (created on first use; flushed at exit).
+    """
+    global imageWriter
+    if imageWriter is None:
+        imageWriter = ImageWriter(Levers.imageWriterThreads, Levers.imageWriterQueue)
+        atexit.register(imageWriter.close)
+    return imageWriter
+
+
+def flushImages():
+    """
+    Waits for the background image writes, if any; returns their errors.
+    """
+    if imageWriter is None:
+        return []
+    return imageWriter.flush()
+
+
+class DebugBundle():
+    """
+    Collects a spread's debug images and OCR intermediates into a single zip file, instead of hundreds of small files.
+
+    Images are stored as PNG (TIFF when so requested) encoded with fast compression, and other files deflated at
+    the fastest level. manifest.json records, per entry, its name, the processing stage (the facsimile's image type),
+    the save index, and the offset and shape of the image. Entries may be added from several threads.
+    Use DebugBundleReader to browse a bundle.
+    """
+
+    def __init__(self, fileName):
+        directory = os.path.dirname(fileName)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.fileName = fileName
+        self.archive = zipfile.ZipFile(fileName, 'w', zipfile.ZIP_DEFLATED, compresslevel=1)
+        self.manifest = []
+        self.lock = threading.Lock()
+
+    def addImage(self, name, imageArea, fileType="PNG", entry=None):
+        """
+        Adds an image array to the bundle.
+        :param entry: dict of manifest information (e.g. stage, index, offset); name and shape are added
+        """
+        data = io.BytesIO()
+        if fileType == "PNG":
+            Image.fromarray(imageArea).save(data, fileType, compress_level=1)
+        else:
+            Image.fromarray(imageArea).save(data, fileType)
+
+        info = dict(entry) if entry is not None else {}
+        info['name'] = name
+        info['shape'] = list(imageArea.shape)
+        # PNG data is already compressed.
+        self.addBytes(name, data.getvalue(), info, zipfile.ZIP_STORED if fileType == "PNG" else zipfile.ZIP_DEFLATED)
+
+    def addFile(self, name, path, entry=None, remove=True):
+        """
+        Adds a file (e.g. a Tesseract intermediate) to the bundle; by default, the file is then removed.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        info = dict(entry) if entry is not None else {}
+        info['name'] = name
+        self.addBytes(name, data, info)
+        if remove:
+            os.remove(path)
+
+    def addBytes(self, name, data, info, compression=zipfile.ZIP_DEFLATED):
+        with self.lock:
+            self.archive.writestr(name, data, compression)
+            self.manifest.append(info)
+
+    def close(self):
+        with self.lock:
+            self.archive.writestr('manifest.json', json.dumps(self.manifest, indent=1))
+            self.archive.close()
+
+
+class DebugBundleReader():
+    """
+    Reads a DebugBundle: lists its entries and returns images as arrays.
+    """
+
+    def __init__(self, fileName):
+        self.archive = zipfile.ZipFile(fileName, 'r')
+        if 'manifest.json' in self.archive.namelist():
+            self.manifest = json.loads(self.archive.read('manifest.json').decode('utf-8'))
+        else:
+            # An unfinished bundle (e.g. the processing was interrupted) has no manifest.
+            self.manifest = [{'name': name} for name in self.archive.namelist()]
+
+    def getManifest(self, stage=None):
+        """
+        Returns the manifest entries; optionally, only those of the given stage.
+        """
+        return [entry for entry in self.manifest if stage is None or entry.get('stage') == stage]
+
+    def getNames(self, stage=None):
+        return [entry['name'] for entry in self.getManifest(stage)]
+
+    def getImage(self, name):
+        with Image.open(io.BytesIO(self.archive.read(name))) as img:
+            return array(img)
+
+    def getText(self, name, encoding='utf-8'):
+        return self.archive.read(name).decode(encoding)
+
+    def close(self):
+        self.archive.close()
+
+
+debugBundle = None
+
+
+def openDebugBundle(fileName):
+    """
+    Starts collecting the debug images into a bundle (see DebugBundle); closes a previous bundle.
+    """
+    global debugBundle
+    closeDebugBundle()
+    debugBundle = DebugBundle(fileName)
+    return debugBundle
+
+
+def getDebugBundle():
+    return debugBundle
+
+
+def closeDebugBundle():
+    """
+    Waits for the pending image writes and closes the current bundle, if any; returns the write errors.
+    """
+    global debugBundle
+    errors = flushImages()
+    if debugBundle is not None:
+        debugBundle.close()
+        debugBundle = None
+    return errors
+
+
+# EXIF orientation tag and the transposes that undo each orientation value.
+exifOrientationTag = 0x0112
+exifTransposes = {2: [Image.FLIP_LEFT_RIGHT],
+                  3: [Image.ROTATE_180],
+                  4: [Image.FLIP_TOP_BOTTOM],
+                  5: [Image.TRANSPOSE],
+                  6: [Image.ROTATE_270],
+                  7: [Image.TRANSVERSE],
+                  8: [Image.ROTATE_90]}
+
+
+def readImageHeader(dir_in, file_name):
+    """
+    Reads an image's dimensions and EXIF orientation from the file header only (no pixels are decoded).
+    The dimensions are those of the image as displayed, i.e. after the EXIF orientation is applied.
+    :return: (width, height, orientation); orientation is 1 when the image has no EXIF orientation
+    """
+    with Image.open(dir_in + file_name) as img:
+        (width, height) = img.size
+        orientation = img.getexif().get(exifOrientationTag, 1)
+
+    if orientation in (5, 6, 7, 8):
+        (width, height) = (height, width)
+    return (width, height, orientation)
+
+
+def isSpread(dir_in, file_name):
+    """
+    Pre-screens an image from its header: a two-page spread is expected to be landscape.
+    """
+    (width, height, orientation) = readImageHeader(dir_in, file_name)
+    return width >= height
+
+
+def loadImage(dir_in, file_name, reduce=1):
+    """
+    Loads an image and returns it as an array. The EXIF orientation, if any, is applied.
+    :param reduce: if larger than 1, the image is decoded at a reduced scale of about 1/reduce (e.g. 2 or 4 for half
+        or quarter resolution, for stages that need no more); JPEG images are then decoded directly at the reduced
+        scale (DCT scaling) where possible
+    """
+    with Image.open(dir_in + file_name) as img:
+        orientation = img.getexif().get(exifOrientationTag, 1)
+
+        if reduce > 1:
+            # JPEG decoding can scale by 1/2, 1/4 or 1/8; the rest of the factor is reduced after decoding.
+            draftFactor = min(reduce & -reduce, 8)
+            (width, height) = img.size
+            img.draft(img.mode, (max(width // draftFactor, 1), max(height // draftFactor, 1)))
+            draftFactor = max(width // img.size[0], 1)
+            if reduce // draftFactor > 1:
+                img = img.reduce(reduce // draftFactor)
+
+        for method in exifTransposes.get(orientation, []):
+            img = img.transpose(method)
+
+        img = array(img)
     #img = img.convert('RGB')
     return img
 
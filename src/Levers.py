@@ -30,6 +30,46 @@ debugFlag = True
 # Kludge: If running on Win32bit, let's binarise the original image in four quadrants.
 kludgeWin32bit = False
 
+# If set, the spread is binarised in tiles of this size (px) to bound the memory use (see SpreadLevel.gsauvolaTiled).
+# With the gaussian filter, the tiles should be well larger than its reach (4*150px at half scale).
+binarisationTileSize = None
+
+# If set, spread-level results (binarisation, border removal, page extraction) are cached on disk in
+# <dir_out><cacheDir> by the image's content hash, so re-runs skip those stages. The least recently used entries are
+# evicted over cacheMaxBytes.
+useStageCache = False
+cacheDir = "cache/"
+cacheMaxBytes = 4 * 1024**3
+
+# Debug images are encoded and written by background threads (see HelperFunctions.ImageWriter); at most
+# imageWriterQueue images wait to be written at a time.
+writeImagesInBackground = True
+imageWriterThreads = 2
+imageWriterQueue = 16
+
+# If set, each spread's numbered debug images and Tesseract intermediates are collected into a single zip file,
+# <dir_out><saveDir>.zip, with a manifest (see HelperFunctions.DebugBundle and DebugBundleReader).
+useDebugBundle = False
+
+# OCR: the Tesseract command, and whether to use long-lived OCR worker processes (see OCR.OCRPool) instead of one
+# Tesseract run per splice. The workers need the Tesseract API (tesserocr, see README.txt) to load the models once;
+# without it they fall back to the Tesseract command per splice (with a warning). tessdataDir is the directory of
+# the traineddata files for the API (None: Tesseract's default).
+tesseractCommand = "tesseract.exe"
+useOCRPool = True
+ocrWorkersPerType = 2
+tessdataDir = None
+# Pages are OCRed by ocrThreads background threads (see DocumentImageUnderstanding.OCRQueue) while the next pages are
+# analysed; the XML is written in document order. 0: OCR each page before going on (serial).
+ocrThreads = 4
+# With the OCR pool, splices are recognised in memory; set keepOCRFiles to also write the _tes.tif/_tes.txt files.
+keepOCRFiles = False
+# OCR results are cached in <dir_out><ocrCacheDir>, keyed by the splice's pixels and the OCR settings (see OCR.OCRCache), so
+# re-runs only OCR the splices that changed. The least recently used results are evicted over ocrCacheMaxBytes.
+useOCRCache = True
+ocrCacheDir = "cache/ocr/"
+ocrCacheMaxBytes = 256 * 1024**2
+
 # Path to style.css for HTML testing pages
 style = "C:/testRel/style.css"
 
@@ -0,0 +1,492 @@
+# AnalyseResolutions - OCR. Tuomo Toljamo (King's College London; DiXiT) at the Huygens ING (KNAW), 2016.
+#
+# This PhDWare code-sketch was part of a pilot exploring the use and usefulness of image data and visual information in
+# the digital opening of an archival series, the Resolutions of the States General 1576‒1796.
+#
+# DiXiT (Digital Scholarly Editions Initial Training Network) has been funded from the People Programme (Marie Curie Actions)
+# of the European Union's Seventh Framework Programme FP7/2007-2013/ under REA grant agreement n° 317436.
+
+# OCR.py.
+# Long-lived Tesseract workers: one set of worker processes per model/config combination, each loading its
+# traineddata once and recognising the image arrays sent to it over a pipe; and a persistent cache of OCR results.
+
+import atexit
+import hashlib
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import numpy as np
+from PIL import Image
+import Levers
+import HelperFunctions as fu
+
+
+# Tesseract language models, page segmentation mode and config file per OCR type.
+ocrSettings = {'body': ("custom_body_v2_1740_2+emop_body_v2_1740_2", 6, "bodyConfig.txt"),
+               'head': ("custom_head_v2_1740_2", 6, "headConfig.txt"),
+               'dateline': ("custom_dateline_v1", 4, "datelineConfig.txt"),
+               'initial': ("custom_body_v2_1740_2+emop_body_v2_1740_2", 10, None)}
+
+# Bump when the recognition changes in a way the cache keys do not capture (e.g. retrained traineddata, a new
+# Tesseract version), so that old cached results are no longer used.
+ocrCacheVersion = 1
+
+
+def getOCRSettings(type):
+    """
+    Returns (languages, psm, configFile) for an OCR type; other types (e.g. 'default') use the body settings.
+    """
+    return ocrSettings.get(type, ocrSettings['body'])
+
+
+def getTesseractArguments(type):
+    """
+    Returns the Tesseract command line arguments for an OCR type.
+    """
+    (languages, psm, configFile) = getOCRSettings(type)
+    arguments = "-l " + languages + " -psm " + str(psm)
+    if configFile is not None:
+        arguments = arguments + " " + configFile
+    return arguments
+
+
+def readConfigFile(configFile):
+    """
+    Returns the (name, value) pairs of a Tesseract config file.
+    """
+    variables = []
+    if configFile is None:
+        return variables
+    with open(configFile, 'r') as f:
+        for line in f:
+            parts = line.split(None, 1)
+            if len(parts) == 2 and not parts[0].startswith('#'):
+                variables.append((parts[0], parts[1].strip()))
+    return variables
+
+
+def textToLines(text):
+    """
+    Splits recognised text into lines as read from a Tesseract output file: line breaks removed, empty lines
+    dropped.
+    """
+    lines = [line.replace("\r", "") for line in text.split("\n")]
+    return [x for x in lines if x]
+
+
+class TesseractAPIEngine():
+    """
+    Recognises images through the Tesseract API (tesserocr); the models are loaded once.
+    """
+
+    def __init__(self, languages, psm, configFile):
+        import tesserocr
+
+        self.api = tesserocr.PyTessBaseAPI(path=Levers.tessdataDir, lang=languages, psm=psm)
+        for (name, value) in readConfigFile(configFile):
+            self.api.SetVariable(name, value)
+
+    def recognise(self, imageArea, words=False):
+        self.api.SetImage(Image.fromarray(imageArea))
+        text = self.api.GetUTF8Text()
+        if not words:
+            return text
+        return (text, self.getWords())
+
+    def recogniseBatch(self, imageAreas):
+        """
+        Returns the texts recognised from a list of image arrays.
+        """
+        return [self.recognise(imageArea) for imageArea in imageAreas]
+
+    def getWords(self):
+        """
+        Returns the words of the last recognition as (word, (x1, y1, x2, y2), confidence) tuples.
+        """
+        import tesserocr
+
+        wordList = []
+        level = tesserocr.RIL.WORD
+        iterator = self.api.GetIterator()
+        if iterator is None:
+            return wordList
+        for word in tesserocr.iterate_level(iterator, level):
+            text = word.GetUTF8Text(level)
+            if text:
+                wordList.append((text, word.BoundingBox(level), word.Confidence(level)))
+        return wordList
+
+
+class TesseractCommandEngine():
+    """
+    Recognises images by running the Tesseract command; used when the Tesseract API (tesserocr) is not available.
+    """
+
+    def __init__(self, languages, psm, configFile):
+        self.arguments = ["-l", languages, "-psm", str(psm)]
+        if configFile is not None:
+            self.arguments.append(configFile)
+
+    def recognise(self, imageArea, words=False):
+        """
+        Note: word boxes and confidences are not available from the command (None is returned for them).
+        """
+        text = self.runCommand(imageArea)
+        if not words:
+            return text
+        return (text, None)
+
+    def recogniseBatch(self, imageAreas):
+        """
+        Returns the texts recognised from a list of image arrays, in one Tesseract run: the images are passed as a
+        list file, and the output is split at the page separators (form feeds). A single image is recognised
+        directly; and if the list file run fails (e.g. a Tesseract build that does not accept list files) or its
+        output does not split into the expected number of pages, the images are recognised one by one.
+        """
+        if len(imageAreas) == 1:
+            return [self.runCommand(imageAreas[0])]
+
+        directory = tempfile.mkdtemp()
+        try:
+            listFile = os.path.join(directory, "batch.txt")
+            with open(listFile, 'w') as f:
+                for (n, imageArea) in enumerate(imageAreas):
+                    imageFile = os.path.join(directory, str(n) + ".tif")
+                    Image.fromarray(imageArea).save(imageFile, "TIFF")
+                    f.write(imageFile + "\n")
+
+            outputBase = os.path.join(directory, "batch")
+            subprocess.check_output([Levers.tesseractCommand, listFile, outputBase] + self.arguments)
+            with open(outputBase + ".txt", 'r', encoding='utf-8') as f:
+                pages = f.read().split("\f")
+        except (subprocess.CalledProcessError, OSError):
+            pages = []
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        # Each page keeps its separator, as in the output of a single image.
+        if len(pages) == len(imageAreas) + 1 and pages[-1].strip() == "":
+            return [page + "\f" for page in pages[:-1]]
+        return [self.runCommand(imageArea) for imageArea in imageAreas]
+
+    def runCommand(self, imageArea):
+        (handle, imageFile) = tempfile.mkstemp(suffix=".tif")
+        os.close(handle)
+        outputBase = imageFile[:-len(".tif")]
+        try:
+            Image.fromarray(imageArea).save(imageFile, "TIFF")
+            subprocess.check_output([Levers.tesseractCommand, imageFile, outputBase] + self.arguments)
+            with open(outputBase + ".txt", 'r', encoding='utf-8') as f:
+                return f.read()
+        finally:
+            for fileName in (imageFile, outputBase + ".txt"):
+                if os.path.exists(fileName):
+                    os.remove(fileName)
+
+
+def createOCREngine(languages, psm, configFile):
+    if getEngineName() == 'command':
+        return TesseractCommandEngine(languages, psm, configFile)
+    return TesseractAPIEngine(languages, psm, configFile)
+
+
+def getEngineName():
+    """
+    Returns 'api' if the Tesseract API (tesserocr) is available, otherwise 'command'.
+    """
+    try:
+        import tesserocr
+    except ImportError:
+        return 'command'
+    return 'api'
+
+
+# The OCR workers are spawned, not forked: they are started from the OCR queue's threads while other threads (e.g.
+# the image writer's) are running, and a forked child could deadlock on a lock held at the time of the fork.
+ocrContext = multiprocessing.get_context('spawn')
+
+# The Levers the engines use; a spawned worker imports Levers afresh, so the caller's values are passed on.
+workerLevers = ('tesseractCommand', 'tessdataDir')
+
+
+def runOCRWorker(connection, languages, psm, configFile, leverValues):
+    """
+    The worker process: creates the engine once, then serves the requests it receives until it gets None:
+    ('recognise', (image array, words)) or ('batch', (list of image arrays,)).
+    Replies (True, result) or (False, error message).
+    :param leverValues: the caller's values of workerLevers, as a dict
+    """
+    for (name, value) in leverValues.items():
+        setattr(Levers, name, value)
+    engine = createOCREngine(languages, psm, configFile)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        (method, arguments) = request
+        try:
+            if method == 'batch':
+                result = engine.recogniseBatch(*arguments)
+            else:
+                result = engine.recognise(*arguments)
+            connection.send((True, result))
+        except Exception as e:
+            connection.send((False, repr(e)))
+    connection.close()
+
+
+class OCRWorker():
+    """
+    A long-lived OCR worker process for one model/config combination. A lost worker (e.g. crashed or killed) is
+    detected and restarted, and the request is retried once.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.process = None
+        self.connection = None
+        self.start()
+
+    def start(self):
+        (self.connection, workerConnection) = ocrContext.Pipe()
+        leverValues = dict((name, getattr(Levers, name)) for name in workerLevers)
+        self.process = ocrContext.Process(target=runOCRWorker,
+                                          args=(workerConnection,) + tuple(self.settings) + (leverValues,))
+        self.process.daemon = True
+        self.process.start()
+        workerConnection.close()
+
+    def restart(self):
+        print("WARNING. An OCR worker (" + self.settings[0] + ") was lost; restarting it.")
+        self.stop()
+        self.start()
+
+    def recognise(self, imageArea, words=False):
+        """
+        Returns the text recognised from an image array; with words, (text, word list) (see OCRPool.recognise()).
+        """
+        return self.call('recognise', (imageArea, words))
+
+    def recogniseBatch(self, imageAreas):
+        """
+        Returns the texts recognised from a list of image arrays.
+        """
+        return self.call('batch', (imageAreas,))
+
+    def call(self, method, arguments):
+        for attempt in range(0, 2):
+            if not self.process.is_alive():
+                self.restart()
+            try:
+                self.connection.send((method, arguments))
+                (ok, result) = self.connection.recv()
+            except (EOFError, OSError):
+                self.restart()
+                continue
+            if not ok:
+                raise RuntimeError("OCR failed: " + result)
+            return result
+        raise RuntimeError("The OCR worker (" + self.settings[0] + ") was lost repeatedly.")
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.connection.close()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+class OCRPool():
+    """
+    Holds the OCR workers: up to workersPerType workers per model/config combination, started on first use.
+    recognise() may be called from several threads; each call takes an idle worker (or waits for one).
+    """
+
+    def __init__(self, workersPerType=1):
+        self.workersPerType = workersPerType
+        self.idle = {}
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def getWorker(self, settings):
+        with self.lock:
+            if settings not in self.idle:
+                self.idle[settings] = queue.Queue()
+                self.workers[settings] = []
+            if self.idle[settings].empty() and len(self.workers[settings]) < self.workersPerType:
+                worker = OCRWorker(settings)
+                self.workers[settings].append(worker)
+                return worker
+        return self.idle[settings].get()
+
+    def recognise(self, imageArea, type='default', words=False):
+        """
+        Returns the text recognised from an image array with the models and settings of the OCR type.
+        :param words: if True, returns (text, word list), the word list holding (word, (x1, y1, x2, y2), confidence)
+            tuples (None if the engine cannot provide them)
+        """
+        settings = getOCRSettings(type)
+        worker = self.getWorker(settings)
+        try:
+            return worker.recognise(imageArea, words)
+        finally:
+            self.idle[settings].put(worker)
+
+    def recogniseBatch(self, imageAreas, type='default'):
+        """
+        Returns the texts recognised from a list of image arrays, sent to one worker as a single request.
+        """
+        settings = getOCRSettings(type)
+        worker = self.getWorker(settings)
+        try:
+            return worker.recogniseBatch(imageAreas)
+        finally:
+            self.idle[settings].put(worker)
+
+    def close(self):
+        with self.lock:
+            for workers in self.workers.values():
+                for worker in workers:
+                    worker.stop()
+            self.idle = {}
+            self.workers = {}
+
+
+# Guards the creation of the shared OCR pool and cache, which may first be asked for by several OCR queue threads.
+sharedLock = threading.Lock()
+
+ocrPool = None
+
+
+def getOCRPool():
+    """
+    Returns the shared OCR pool (created on first use; its workers are stopped at exit).
+    Note: the workers load the models once only through the Tesseract API (tesserocr); without it, they run the
+    Tesseract command for each splice, and a warning is printed when the pool is created.
+    """
+    global ocrPool
+    with sharedLock:
+        if ocrPool is None:
+            if getEngineName() == 'command':
+                print("WARNING. tesserocr is not installed: the OCR workers run the Tesseract command for each splice, "
+                      "reloading the traineddata every time. Install tesserocr (see README.txt) to load the models once.")
+            ocrPool = OCRPool(Levers.ocrWorkersPerType)
+            atexit.register(ocrPool.close)
+        return ocrPool
+
+
+class OCRCache():
+    """
+    A persistent cache of OCR results (see fu.DiskCache), keyed by the pixels of the final (padded) splice and the
+    engine configuration: languages, page segmentation mode, the content of the config file and the engine in use.
+    Re-processing a volume after a layout change then only OCRs the splices that actually changed.
+    The cache may be shared by several processes; hits and misses are counted per process.
+    """
+
+    def __init__(self, directory, maxBytes):
+        self.cache = fu.DiskCache(directory, maxBytes)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def makeKey(self, imageArea, type='default'):
+        (languages, psm, configFile) = getOCRSettings(type)
+        imageArea = np.ascontiguousarray(imageArea)
+        imageHash = hashlib.sha1(imageArea.tobytes()).hexdigest()
+        return self.cache.makeKey('ocr', ocrCacheVersion, imageHash, imageArea.shape, str(imageArea.dtype), languages,
+                                  psm, configFile, getConfigHash(configFile), getEngineName())
+
+    def load(self, key):
+        """
+        Returns the text cached for the key; None if there is none.
+        """
+        arrays = self.cache.load(key)
+        with self.lock:
+            if arrays is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return str(arrays['text'])
+
+    def store(self, key, text):
+        self.cache.store(key, {'text': np.array(text)})
+
+    def getCounts(self):
+        """
+        Returns (hits, misses) since the cache was created.
+        """
+        with self.lock:
+            return (self.hits, self.misses)
+
+
+def getConfigHash(configFile):
+    """
+    Returns the SHA-1 of a Tesseract config file's content (None if there is no config file).
+    """
+    if configFile is None or not os.path.exists(configFile):
+        return None
+    return fu.hashFile(configFile)
+
+
+ocrCache = None
+
+
+def getOCRCache():
+    """
+    Returns the shared OCR result cache, in <dir_out><ocrCacheDir> (created on first use); None if Levers.useOCRCache
+    is not set.
+    """
+    global ocrCache
+    if not Levers.useOCRCache:
+        return None
+    with sharedLock:
+        if ocrCache is None:
+            ocrCache = OCRCache(Levers.dir_out + Levers.ocrCacheDir, Levers.ocrCacheMaxBytes)
+        return ocrCache
+
+
+def recognise(imageArea, type='default'):
+    """
+    Returns the text recognised from an image array (see recogniseBatch()).
+    """
+    return recogniseBatch([imageArea], type)[0]
+
+
+def recogniseBatch(imageAreas, type='default'):
+    """
+    Returns the texts recognised from a list of image arrays with the models and settings of the OCR type. Results
+    are looked up in the OCR cache first (see getOCRCache()); the rest are recognised as one job: through the OCR
+    pool with Levers.useOCRPool, otherwise with a single Tesseract run.
+    """
+    texts = [None] * len(imageAreas)
+    cache = getOCRCache()
+    if cache is not None:
+        keys = [cache.makeKey(imageArea, type) for imageArea in imageAreas]
+        texts = [cache.load(key) for key in keys]
+
+    missing = [n for n in range(0, len(imageAreas)) if texts[n] is None]
+    if len(missing) == 0:
+        return texts
+
+    missingAreas = [imageAreas[n] for n in missing]
+    if Levers.useOCRPool:
+        recognised = getOCRPool().recogniseBatch(missingAreas, type)
+    else:
+        recognised = createOCREngine(*getOCRSettings(type)).recogniseBatch(missingAreas)
+
+    for (n, text) in zip(missing, recognised):
+        texts[n] = text
+        if cache is not None:
+            cache.store(keys[n], text)
+    return texts
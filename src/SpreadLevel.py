@@ -12,13 +12,28 @@ import numpy as np
 from scipy.ndimage import interpolation,filters
 from PIL import Image
 import numpy
+import tracemalloc
+import HelperFunctions as fu
+
+# Sauvola parameters used for the spreads (also part of the stage cache keys).
+sauvolaSigma = 150.0
+sauvolaK = 0.3
+sauvolaScale = 2.0
+
+# Bump when a stage changes its output, so that its old cache entries are no longer used: binarisationVersion for
+# the binarisation, pageStagesVersion for border removal and page extraction (which reuse a cached binarisation).
+binarisationVersion = 2
+pageStagesVersion = 1
 
 
 # ## BINARISATION ##
-def SauvolaBinarise(original, filterType):
+def SauvolaBinarise(original, filterType, tileSize=None, margin=None):
     """
     Preprocessing: Sauvola binarisation. Utilises the Sauvola algorithm distributed with Breuel's OCRopus (Ocropy) toolkit.
     :param original: facsimile image
+    :param tileSize: if given, the image is binarised in tiles of this size (px) to bound the memory use; see
+        gsauvolaTiled()
+    :param margin: the overlap margin of the tiles; see gsauvolaTiled()
     :return: binarised facsimile image
     """
 
@@ -26,21 +41,24 @@ def SauvolaBinarise(original, filterType):
     # omit a pixel from either/both dimensions if needed.
 
     # Let's see if one or both dimensions are not even.
-    iOffset = (original.getImage().shape[0] % 2)
-    jOffset = (original.getImage().shape[1] % 2)
+    iOffset = (original.getShape()[0] % 2)
+    jOffset = (original.getShape()[1] % 2)
 
     # Let's omit a row or column of pixels if needed.
     if (iOffset != 0 and jOffset != 0):
-        inp = original.getImage()[:-iOffset, :-jOffset]
+        inp = original.getView()[:-iOffset, :-jOffset]
     elif (iOffset != 0):
-        inp = original.getImage()[:-iOffset, :]
+        inp = original.getView()[:-iOffset, :]
     elif (jOffset != 0):
-        inp = original.getImage()[:, :-jOffset]
+        inp = original.getView()[:, :-jOffset]
     else:
-        inp = original.getImage()[:, :]
+        inp = original.getView()[:, :]
 
     # gsauvola() extracted and adapted from Breuel's OCRopus
-    binImage = gsauvola(inp, 150.0, None, 0.3, filterType, 2.0)
+    if tileSize is None:
+        binImage = gsauvola(inp, sauvolaSigma, None, sauvolaK, filterType, sauvolaScale)
+    else:
+        binImage = gsauvolaTiled(inp, sauvolaSigma, None, sauvolaK, filterType, sauvolaScale, tileSize, margin)
 
     binarised = dia.Facsimile(binImage, 'binarised', (0,0))
     if Levers.debugFlag:
@@ -51,99 +69,292 @@ def SauvolaBinarise(original, filterType):
     return binarised
 
 
-def gsauvola(image,sigma=150.0,R=None,k=0.3,filter='uniform',scale=2.0):
+# ## SPREAD-LEVEL STAGES ##
+def processSpread(original, fileName, filterType='gaussian', tileSize=None, cache=None):
+    """
+    Runs the spread-level stages (binarisation, border removal and page extraction) and returns the page facsimiles.
+    If a cache (fu.DiskCache) is given, the results are looked up by the content hash of the input file and the stage
+    parameters, so that a re-run on the same spread skips the stages (and their debug saves).
+    :param original: facsimile of the spread
+    :param fileName: path to the spread's image file; its content is hashed for the cache keys
+    :param filterType: see SauvolaBinarise()
+    :param tileSize: see SauvolaBinarise()
+    :param cache: fu.DiskCache or None
+    :return: list of the page facsimiles
+    """
+    if cache is None:
+        binarised = SauvolaBinarise(original, filterType, tileSize)
+        return dia.extractPages(dia.cropBorderShadows(binarised, 'remBorders'))
+
+    fileHash = fu.hashFile(fileName)
+    binKey = cache.makeKey('binarised', binarisationVersion, fileHash, filterType, sauvolaSigma, sauvolaK,
+                           sauvolaScale)
+    pagesKey = cache.makeKey('pages', pageStagesVersion, binKey, dia.borderBandWidth, dia.borderCropMargin)
+
+    pages = cache.load(pagesKey)
+    if pages is not None:
+        return arraysToFacsList(pages)
+
+    stored = cache.load(binKey)
+    if stored is not None:
+        binarised = arraysToFacsList(stored)[0]
+    else:
+        binarised = SauvolaBinarise(original, filterType, tileSize)
+        cache.store(binKey, facsListToArrays([binarised]))
+
+    pages = dia.extractPages(dia.cropBorderShadows(binarised, 'remBorders'))
+    cache.store(pagesKey, facsListToArrays(pages))
+
+    return pages
+
+
+def facsListToArrays(facsList):
+    """
+    Converts a list of facsimiles into named arrays for fu.DiskCache.
+    """
+    arrays = {}
+    for (n, facs) in enumerate(facsList):
+        arrays['image' + str(n)] = facs.image
+        arrays['offset' + str(n)] = numpy.array(facs.getOffset())
+        arrays['name' + str(n)] = numpy.array(facs.imageType)
+    return arrays
+
+
+def arraysToFacsList(arrays):
+    """
+    Converts named arrays from fu.DiskCache back into a list of facsimiles.
+    """
+    facsList = []
+    n = 0
+    while ('image' + str(n)) in arrays:
+        offset = tuple(int(x) for x in arrays['offset' + str(n)])
+        facsList.append(dia.Facsimile(arrays['image' + str(n)], str(arrays['name' + str(n)]), offset))
+        n += 1
+    return facsList
+
+
+# Normalisation arrays (the filtered ones) of gsauvola(), by (shape, sigma, filter, dtype).
+normalisationCache = {}
+
+
+def gsauvola(image,sigma=150.0,R=None,k=0.3,filter='uniform',scale=2.0,dtype=np.float64,blockRows=256):
     """Perform Sauvola-like binarization.  This uses linear filters to
     compute the local mean and variance at every pixel."""
     # Note! This Sauvola implementation is borrowed from Breuel's OCRopus (Ocropy) toolkit.
     # See: - https://github.com/tmbdev/ocropy/blob/master/OLD/ocropus-sauvola
     #      - Breuel, T. M. (2008) 'The OCRopus Open Source OCR System'.
     # See also Sauvola, J. & M. Pietikäinen (2000) 'Adaptive Document Image Binarisation' Pattern Recognition 33, 225‒36.
+    #
+    # Adapted to bound the memory use: only the downscaled pixels are converted before the statistics are computed
+    # (in place, in the given dtype; float32 halves their memory at a small cost in accuracy); the threshold is
+    # computed at the downscaled resolution, and the full resolution image is converted and compared with it in
+    # blocks of rows. With float64, the result is that of the original full-size computation.
 
-    if image.dtype==np.dtype('uint8'): image = image / 256.0
-    if len(image.shape)==3: image = np.mean(image,axis=2)
     if filter=="gaussian":
         filter = filters.gaussian_filter
     elif filter=="uniform":
         filter = filters.uniform_filter
     else:
         pass
-    scaled = interpolation.zoom(image,1.0/scale,order=0,mode='nearest')
-    s1 = filter(np.ones(scaled.shape),sigma)
-    sx = filter(scaled,sigma)
+
+    (height, width) = image.shape[0:2]
+    downI = getZoomIndices(height, 1.0/scale)
+    downJ = getZoomIndices(width, 1.0/scale)
+    scaled = np.asarray(normaliseSauvolaInput(image[np.ix_(downI, downJ)]), dtype=dtype)
+
+    s1 = getSauvolaNormalisation(scaled.shape, sigma, filter, dtype)
     sxx = filter(scaled**2,sigma)
+    sx = filter(scaled,sigma)
+    del scaled
+    avg_ = np.divide(sx, s1, out=sx)
+    np.divide(sxx, s1, out=sxx)
+    np.subtract(sxx, avg_**2, out=sxx)
+    np.maximum(sxx, 0.0, out=sxx)
+    stddev_ = np.power(sxx, 0.5, out=sxx)
+
+    # The downscaled pixels sampled back to the full resolution (beyond them, the statistics are zero).
+    upI = getZoomIndices(avg_.shape[0], scale, int(avg_.shape[0]*scale))
+    upJ = getZoomIndices(avg_.shape[1], scale, int(avg_.shape[1]*scale))
+    if R is None: R = max(np.amax(stddev_[np.ix_(np.unique(upI), np.unique(upJ))]), 0.0)
+
+    thresh_ = np.divide(stddev_, R, out=stddev_)
+    thresh_ -= 1.0
+    thresh_ *= k
+    thresh_ += 1.0
+    thresh_ *= avg_
+    del avg_
+    zero = np.dtype(dtype).type(0.0)
+    outside = zero * (1.0 + k * (zero / R - 1.0))
+
+    binImage = np.empty((height, width), dtype=np.uint8)
+    for i0 in range(0, height, blockRows):
+        i1 = min(i0+blockRows, height)
+        thresh = np.full((i1-i0, width), outside, dtype=dtype)
+        rows = np.arange(i0, min(i1, len(upI)))
+        if len(rows) > 0:
+            thresh[:len(rows), :len(upJ)] = thresh_[np.ix_(upI[rows], upJ)]
+        binImage[i0:i1] = 255*(normaliseSauvolaInput(image[i0:i1]) > thresh)
+
+    return binImage
+
+
+def getSauvolaNormalisation(shape, sigma, filter, dtype):
+    """
+    Returns the (cached) normalisation array of gsauvola(): the filter applied to ones.
+    """
+    key = (shape, sigma, filter, np.dtype(dtype))
+    if key not in normalisationCache:
+        if len(normalisationCache) >= 4:
+            normalisationCache.clear()
+        normalisationCache[key] = filter(np.ones(shape, dtype=dtype),sigma)
+    return normalisationCache[key]
+
+
+def measurePeakMemory(function, *args, **kwargs):
+    """
+    Calls the function and measures the peak of the memory allocated during the call (incl. numpy arrays).
+    E.g. measurePeakMemory(gsauvola, image, 150.0, None, 0.3, 'gaussian', 2.0)
+    :return: (the function's return value, peak in bytes)
+    """
+    wasTracing = tracemalloc.is_tracing()
+    if not wasTracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        ret = function(*args, **kwargs)
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        if not wasTracing:
+            tracemalloc.stop()
+    return ret, peak
+
+
+def gsauvolaTiled(image, sigma=150.0, R=None, k=0.3, filter='uniform', scale=2.0, tileSize=1024, margin=None):
+    """
+    gsauvola() computed tile by tile, so that the peak memory use depends on the tile size rather than on the size of
+    the image. The result is written into a preallocated output.
+
+    Each tile's local statistics are computed from the downscaled image extended by an overlap margin, sampled from
+    the same pixels zoom() samples for the whole image. When the margin covers the filter's reach (the default), the
+    tiles have no seams and the result is that of gsauvola() on the whole image; only the floating point rounding of
+    the filters' running sums differs, which can flip a pixel whose value equals its threshold. A smaller margin
+    trades accuracy near the tile edges for memory.
+
+    Without R, the maximum standard deviation is needed from the whole image first, so the statistics are computed
+    in two passes over the tiles.
+    :param tileSize: tile height and width in px of the input image
+    :param margin: overlap margin in px of the downscaled image; by default, the filter's reach (sigma/2 for
+        'uniform', 4*sigma for 'gaussian'; must be given for other filters). Note that every tile is filtered with
+        its margins, so tiles much smaller than the margin are slow.
+    :return: the binarised image as an uint8 array
+    """
+    if filter=="gaussian":
+        filterFunction = filters.gaussian_filter
+        reach = int(4.0*sigma + 0.5)  # gaussian_filter()'s default truncation
+    elif filter=="uniform":
+        filterFunction = filters.uniform_filter
+        reach = int(sigma)//2 + 1
+    else:
+        filterFunction = filter
+        reach = margin
+    if margin is None:
+        margin = reach
+
+    (height, width) = image.shape[0:2]
+
+    # The input pixels sampled for the downscaled image, and the downscaled pixels sampled back, per axis.
+    downI = getZoomIndices(height, 1.0/scale)
+    downJ = getZoomIndices(width, 1.0/scale)
+    upI = getZoomIndices(len(downI), scale, int(len(downI)*scale))
+    upJ = getZoomIndices(len(downJ), scale, int(len(downJ)*scale))
+
+    tiles = []
+    for i in range(0, height, tileSize):
+        for j in range(0, width, tileSize):
+            tiles.append((i, min(i+tileSize, height), j, min(j+tileSize, width)))
+
+    if R is None:
+        R = 0.0
+        for tile in tiles:
+            (avg, stddev) = calculateTileStatistics(image, tile, downI, downJ, upI, upJ, filterFunction, sigma, margin)
+            R = max(R, np.amax(stddev))
+
+    binImage = np.empty((height, width), dtype=np.uint8)
+    for tile in tiles:
+        (i0, i1, j0, j1) = tile
+        (avg, stddev) = calculateTileStatistics(image, tile, downI, downJ, upI, upJ, filterFunction, sigma, margin)
+        thresh = avg * (1.0 + k * (stddev / R - 1.0))
+        binImage[i0:i1, j0:j1] = 255*(normaliseSauvolaInput(image[i0:i1, j0:j1]) > thresh)
+
+    return binImage
+
+
+def calculateTileStatistics(image, tile, downI, downJ, upI, upJ, filterFunction, sigma, margin):
+    """
+    Returns gsauvola()'s local mean and standard deviation for a tile (i0, i1, j0, j1) of the image.
+    Used by gsauvolaTiled().
+    """
+    (i0, i1, j0, j1) = tile
+    avg = np.zeros((i1-i0, j1-j0))
+    stddev = np.zeros((i1-i0, j1-j0))
+
+    # (Pixels beyond the upscaled statistics are left at zero, as in gsauvola().)
+    rows = np.arange(i0, min(i1, len(upI)))
+    cols = np.arange(j0, min(j1, len(upJ)))
+    if len(rows) == 0 or len(cols) == 0:
+        return avg, stddev
+
+    # The downscaled area under the tile, extended by the margin.
+    p0 = max(0, upI[rows[0]] - margin)
+    p1 = min(len(downI), upI[rows[-1]] + margin + 1)
+    q0 = max(0, upJ[cols[0]] - margin)
+    q1 = min(len(downJ), upJ[cols[-1]] + margin + 1)
+
+    scaled = normaliseSauvolaInput(image[np.ix_(downI[p0:p1], downJ[q0:q1])])
+    s1 = filterFunction(np.ones(scaled.shape), sigma)
+    sx = filterFunction(scaled, sigma)
+    sxx = filterFunction(scaled**2, sigma)
     avg_ = sx / s1
-    stddev_ = np.maximum(sxx/s1 - avg_**2,0.0)**0.5
-    s0,s1 = avg_.shape
-    s0 = int(s0*scale)
-    s1 = int(s1*scale)
-    avg = np.zeros(image.shape)
-    interpolation.zoom(avg_,scale,output=avg[:s0,:s1],order=0,mode='nearest')
-    stddev = np.zeros(image.shape)
-    interpolation.zoom(stddev_,scale,output=stddev[:s0,:s1],order=0,mode='nearest')
-    if R is None: R = np.amax(stddev)
-    thresh = avg * (1.0 + k * (stddev / R - 1.0))
-    return np.array(255*(image>thresh),'uint8')
-
-
-def SauvolaBinariseQuadrants(original):
-    # a Kludge to accommodate Win32bit.
-
-    originalArea = original.getImage()
-    originalHeight,originalWidth, dim = originalArea.shape
-
-    heightCutoff = (int)(originalHeight/2)
-    widthCutoff = (int)(originalWidth/2)
-
-    if (heightCutoff % 2 == 1):
-        heightCutoff = heightCutoff -1
-    if (widthCutoff % 2 == 1):
-        widthCutoff = widthCutoff -1
-
-    baseImage = Image.fromarray(originalArea)
-
-    image11Box = (0, 0, widthCutoff, heightCutoff)
-    image11 = baseImage.crop(image11Box)
-    image12Box = (widthCutoff+1, 0, originalWidth, heightCutoff)
-    image12 = baseImage.crop(image12Box)
-    image21Box = (0, heightCutoff+1, widthCutoff, originalHeight)
-    image21 = baseImage.crop(image21Box)
-    image22Box = (widthCutoff+1, heightCutoff+1, originalWidth, originalHeight)
-    image22 = baseImage.crop(image22Box)
-
-    image11 = dia.Facsimile(numpy.array(image11), "tempBin11")
-    image12 = dia.Facsimile(numpy.array(image12), "tempBin12")
-    image21 = dia.Facsimile(numpy.array(image21), "tempBin21")
-    image22 = dia.Facsimile(numpy.array(image22), "tempBin22")
-
-    image11 = SauvolaBinarise(image11).getImage()
-    image12 = SauvolaBinarise(image12).getImage()
-    image21 = SauvolaBinarise(image21).getImage()
-    image22 = SauvolaBinarise(image22).getImage()
-
-    stitchUp = Image.new("L", (originalWidth, originalHeight), "white")
-    stitchUpArea = np.array(stitchUp)
-
-    for i in range(0, image11.shape[0]):
-        for j in range(0, image11.shape[1]):
-            stitchUpArea[i,j] = image11[i,j]
-
-    for i in range(0, image12.shape[0]):
-        for j in range(0, image12.shape[1]):
-            stitchUpArea[i,j+widthCutoff] = image12[i,j]
-
-    for i in range(0, image21.shape[0]):
-        for j in range(0, image21.shape[1]):
-            stitchUpArea[heightCutoff+i,j] = image21[i,j]
-
-    for i in range(0, image22.shape[0]):
-        for j in range(0, image22.shape[1]):
-            stitchUpArea[heightCutoff+i,widthCutoff+j] = image22[i,j]
-
-    binarised = dia.Facsimile(stitchUpArea, "binarised", (0,0))
-    if Levers.debugFlag:
-        binarised.save()
+    stddev_ = np.maximum(sxx/s1 - avg_**2, 0.0)**0.5
 
-    return binarised
+    sample = np.ix_(upI[rows] - p0, upJ[cols] - q0)
+    avg[:len(rows), :len(cols)] = avg_[sample]
+    stddev[:len(rows), :len(cols)] = stddev_[sample]
+    return avg, stddev
+
+
+def normaliseSauvolaInput(image):
+    """
+    Converts an image to gsauvola()'s greyscale [0, 1) range.
+    """
+    if image.dtype==np.dtype('uint8'): image = image / 256.0
+    if len(image.shape)==3: image = np.mean(image,axis=2)
+    return image
+
+
+def getZoomIndices(length, factor, size=None):
+    """
+    Returns the indices of the elements that an order 0 zoom() samples along an axis of the given length, i.e.
+    zoom(a, factor)[n] == a[indices[n]]; with size, the indices for an output of that size.
+    """
+    positions = np.arange(length, dtype=np.float64)
+    if size is None:
+        positions = interpolation.zoom(positions, factor, order=0, mode='nearest')
+    else:
+        out = np.zeros(size)
+        interpolation.zoom(positions, factor, output=out, order=0, mode='nearest')
+        positions = out
+    return positions.astype(np.intp)
+
+
+def getBinarisationTileSize(imageShape):
+    """
+    Returns the tile size for SauvolaBinarise(): with Levers.kludgeWin32bit, the image is binarised in 2x2 tiles
+    (a kludge to accommodate Win32bit); otherwise Levers.binarisationTileSize.
+    """
+    if Levers.kludgeWin32bit:
+        return (max(imageShape[0], imageShape[1]) + 1) // 2
+    return Levers.binarisationTileSize
 
 
 #def diffImages(facs1, facs2):